@@ -1,14 +1,41 @@
+import time
+
+SCRIPT_START = time.perf_counter()  # mesure du temps de démarrage (imports + rendu du login)
+
 import streamlit as st
 import pandas as pd
 import requests
 from datetime import datetime, timedelta, date
+import functools
+import collections
+import hashlib
+import itertools
+import json
+import os
 import re
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import zipfile
+import zlib
+from contextlib import contextmanager
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import duckdb
+
+try:
+    import orjson  # décodage JSON rapide des pages Ksaar
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from textblob import TextBlob
-import nltk
+# La pile NLP (scikit-learn, TextBlob, NLTK) est importée à la demande : voir
+# load_sklearn_text() et load_sentiment_blobber().
+
+IMPORTS_SECONDS = time.perf_counter() - SCRIPT_START
 
 # ==========================
 # CONFIG & SECRETS
@@ -48,24 +75,35 @@ except Exception as e:
         "api_key_password": "",
     }
 
+# Copy-on-Write : les vues distribuées aux sessions ne peuvent jamais modifier
+# les jeux de données partagés (toujours actif à partir de pandas 3).
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 # ==========================
 # RESSOURCES PARTAGÉES
 # ==========================
 
-@st.cache_resource
-def download_nltk_data():
-    try:
-        try:
-            nltk.data.find("tokenizers/punkt")
-            nltk.data.find("taggers/averaged_perceptron_tagger")
-        except LookupError:
-            nltk.download("punkt", quiet=True)
-            nltk.download("averaged_perceptron_tagger", quiet=True)
-    except Exception as e:
-        st.warning(f"Impossible de télécharger les ressources NLTK : {e}")
+# Données NLTK pré-installées au build (voir .devcontainer) : aucun téléchargement au runtime.
+NLTK_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nltk_data")
+HEAVY_MODULES = ["sklearn", "textblob", "nltk"]
+
 
+def load_sklearn_text():
+    """Import paresseux de scikit-learn (uniquement quand une analyse texte tourne)."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+    return TfidfVectorizer, cosine_similarity
 
-download_nltk_data()
+
+def load_sentiment_blobber():
+    """Import paresseux de TextBlob (et donc de NLTK) avec l'analyseur français."""
+    import nltk
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+    from textblob import Blobber
+    from textblob_fr import PatternTagger, PatternAnalyzer
+    return Blobber(pos_tagger=PatternTagger(), analyzer=PatternAnalyzer())
 
 
 @st.cache_resource
@@ -117,39 +155,65 @@ def check_password() -> bool:
     return False
 
 
-def load_data_paginated(df: pd.DataFrame, page_number: int, page_size: int) -> pd.DataFrame:
-    if df is None or df.empty:
-        return pd.DataFrame()
+def format_duration(seconds) -> str:
+    if seconds is None or pd.isna(seconds):
+        return "N/A"
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes} min {secs:02d} s"
+
+
+# colonne `messages_z` : binaire Arrow, pour que la table Arrow des requêtes DuckDB
+# partage ses buffers avec le DataFrame au lieu d'en recopier les transcripts
+TRANSCRIPT_DTYPE = pd.ArrowDtype(pa.binary())
 
-    start_idx = page_number * page_size
-    end_idx = start_idx + page_size
 
-    if start_idx >= len(df):
-        start_idx = 0
-        end_idx = min(page_size, len(df))
+def compress_transcript(text: str) -> bytes:
+    """Transcript compressé (zlib) : seule forme gardée en mémoire et dans le store."""
+    return zlib.compress((text or "").encode("utf-8"))
 
-    end_idx = min(end_idx, len(df))
-    return df.iloc[start_idx:end_idx].copy()
+
+def decompress_transcript(blob) -> str:
+    if blob is None or (not isinstance(blob, (bytes, bytearray)) and pd.isna(blob)):
+        return ""
+    return zlib.decompress(blob).decode("utf-8")
+
+
+def sql_ident(col: str) -> str:
+    return '"' + col.replace('"', '""') + '"'
+
+
+def timed_section(name: str):
+    """Mesure le temps de rendu d'une section (rerun complet ou de son seul fragment)."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                st.session_state.setdefault("render_ms", {})[name] = (time.perf_counter() - start) * 1000
+        return wrapper
+    return decorate
 
 
 def display_pagination_controls(total_items, page_size, current_page, key_prefix: str):
+    """Boutons de page : le callback met à jour la page avant le rerun (pas de second rerun)."""
     total_pages = max(1, (total_items + page_size - 1) // page_size)
     col1, col2, col3 = st.columns([1, 2, 1])
 
+    def go_to(page):
+        st.session_state[key_prefix + "_page"] = page
+
     with col1:
         if current_page > 0:
-            if st.button("← Précédent", key=f"{key_prefix}_prev"):
-                st.session_state[key_prefix + "_page"] = current_page - 1
-                st.rerun()
+            st.button("← Précédent", key=f"{key_prefix}_prev", on_click=go_to, args=(current_page - 1,))
 
     with col2:
         st.write(f"Page {current_page + 1} / {total_pages}")
 
     with col3:
         if current_page < total_pages - 1:
-            if st.button("Suivant →", key=f"{key_prefix}_next"):
-                st.session_state[key_prefix + "_page"] = current_page + 1
-                st.rerun()
+            st.button("Suivant →", key=f"{key_prefix}_next", on_click=go_to, args=(current_page + 1,))
 
 
 # ==========================
@@ -316,185 +380,1760 @@ def get_antenne_from_dst(dst):
 # CHARGEMENT DES DONNÉES
 # ==========================
 
-@st.cache_data(ttl=300)
-def get_ksaar_chats():
-    """Récupère les chats + pré-calcul des flags abusifs."""
-    if not ksaar_config.get("api_base_url"):
-        st.error("API base URL non configurée (secrets.ksaar_config.api_base_url manquant).")
-        return pd.DataFrame()
+# Tailles de page essayées, de la plus grande à la plus petite : la première
+# acceptée par l'API est mémorisée pour le reste du process.
+KSAAR_PAGE_LIMITS = (1000, 500, 250, 100)
+ksaar_page_limit = {}
+# Crawl incrémental (`since`) : première page réduite, élargie (×2) tant que les pages
+# sont entièrement plus récentes que `since`, jusqu'à la taille négociée.
+KSAAR_POLL_LIMIT = 50
 
-    workflow_id = "1500d159-5185-4487-be1f-fa18c6c85ec5"  # chats
-    url = f"{ksaar_config['api_base_url']}/v1/workflows/{workflow_id}/records"
-    auth = (ksaar_config["api_key_name"], ksaar_config["api_key_password"])
 
-    all_records = []
-    current_page = 1
-    pattern, abuse_keywords = compile_abuse_patterns()
+@st.cache_resource
+def get_ksaar_session() -> requests.Session:
+    """Session HTTP partagée (keep-alive, réponses compressées)."""
+    session = requests.Session()
+    session.auth = (ksaar_config["api_key_name"], ksaar_config["api_key_password"])
+    session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+    return session
+
+
+class KsaarCrawlError(Exception):
+    """Crawl Ksaar interrompu (erreur réseau, HTTP ou JSON) : son résultat partiel ne doit pas être publié."""
+
+
+def iter_ksaar_pages(workflow_id: str, label: str, since=None, known=None):
+    """Parcourt les pages d'un workflow Ksaar (du plus récent au plus ancien).
+
+    Négocie la plus grande taille de page acceptée (repli sur la suivante en
+    cas de 400/413/422 à la première page) et décode le corps brut avec orjson.
+    Produit les enregistrements de chaque page ; s'arrête à la dernière page ou,
+    avec `since`, à la première page contenant des enregistrements plus anciens.
+    Avec `since`, les pages partent de KSAAR_POLL_LIMIT enregistrements et ne
+    s'élargissent que si la précédente était entièrement plus récente ; les
+    enregistrements antérieurs à `since` ou déjà connus (`known`, voir
+    `fresh_records`) sont écartés avant d'être transformés.
+    Toute erreur en cours de route lève KsaarCrawlError : un crawl tronqué n'est
+    jamais confondu avec un crawl complet.
+    """
+    url = f"{ksaar_config['api_base_url']}/v1/workflows/{workflow_id}/records"
+    session = get_ksaar_session()
+    limits = list(KSAAR_PAGE_LIMITS)
+    if workflow_id in ksaar_page_limit:
+        limits = limits[limits.index(ksaar_page_limit[workflow_id]):]
+    if since is None:
+        limit = limits[0]
+    else:
+        # taille maximale KSAAR_POLL_LIMIT × 2^k : chaque page reste alignée sur les précédentes
+        limit = ceiling = KSAAR_POLL_LIMIT
+        while ceiling * 2 <= ksaar_page_limit.get(workflow_id, KSAAR_PAGE_LIMITS[-1]):
+            ceiling *= 2
+    offset = 0
 
     while True:
-        params = {"page": current_page, "limit": 100, "sort": "-createdAt"}
+        current_page = offset // limit + 1
+        params = {"page": current_page, "limit": limit, "sort": "-createdAt"}
         try:
-            resp = requests.get(url, params=params, auth=auth, timeout=30)
+            resp = session.get(url, params=params, timeout=30)
         except Exception as e:
-            st.error(f"Erreur de connexion à l'API Chats : {e}")
-            break
+            st.error(f"Erreur de connexion à l'API {label} : {e}")
+            raise KsaarCrawlError(f"{label}, page {current_page} : {e}") from e
+
+        if resp.status_code in (400, 413, 422) and since is None and offset == 0 and len(limits) > 1:
+            limits.pop(0)  # taille refusée : on réessaie plus petit
+            limit = limits[0]
+            continue
 
         if resp.status_code != 200:
-            st.error(f"Erreur API Chats (status {resp.status_code}) pour la page {current_page}")
+            st.error(f"Erreur API {label} (status {resp.status_code}) pour la page {current_page}")
             try:
                 st.text(f"Réponse brute : {resp.text[:500]}")
             except Exception:
                 pass
-            break
+            raise KsaarCrawlError(f"{label}, page {current_page} : status {resp.status_code}")
 
-        data = resp.json()
+        if since is None:
+            ksaar_page_limit[workflow_id] = limit
+        try:
+            data = json_loads(resp.content)
+        except ValueError as e:
+            st.error(f"Réponse illisible de l'API {label} pour la page {current_page}")
+            raise KsaarCrawlError(f"{label}, page {current_page} : {e}") from e
         records = data.get("results", [])
         if not records:
-            # st.info(f"Aucun enregistrement de chat pour la page {current_page}.")
-            break
-
-        for record in records:
-            rd = {
-                "Crée le": record.get("createdAt"),
-                "Modifié le": record.get("updatedAt"),
-                "IP": record.get("IP 2", ""),
-                "pnd_time": record.get("Date complète début 2"),
-                "id_chat": record.get("Chat ID 2"),
-                "messages": record.get("Conversation complète 2", ""),
-                "last_user_message": record.get("Date complète fin 2"),
-                "last_op_message": record.get("Date complète début 2"),
-                "Message système 1": record.get("Message système 1", ""),
-                "Département Origine 2": record.get("Département Origine 2", ""),
-            }
-            op_id = record.get("Opérateur ID (API) 1")
-            op_name = get_operator_name(op_id)
-            rd["Operateur_Name"] = op_name
-            rd["Volunteer_Location"] = get_volunteer_location(op_name)
+            return
+        fresh = fresh_records(records, since, known)
+        if fresh:
+            yield fresh
 
-            raw_antenne = extract_antenne(rd["Message système 1"], rd["Département Origine 2"])
-            rd["Antenne"] = get_normalized_antenne(raw_antenne)
+        if current_page >= data.get("lastPage", 1) or reached_since(records, since):
+            return
+        offset += limit
+        if since is not None:
+            limit = min(offset, ceiling)
+
+
+def fresh_records(records, since=None, known=None) -> list:
+    """Enregistrements d'une page à ingérer : créés depuis `since` et pas déjà connus.
+
+    `known(keys, updated)` renvoie le masque des enregistrements déjà publiés avec
+    la même date de modification : ils sont écartés avant scoring et compression.
+    """
+    if since is None and known is None:
+        return records
+    keep = np.ones(len(records), dtype=bool)
+    if since is not None:
+        created = pd.to_datetime([r.get("createdAt") for r in records], errors="coerce", utc=True)
+        keep &= ~np.asarray(created < since)
+    if known is not None:
+        field, timestamps = page_columns(records)
+        keep &= ~np.asarray(known(field("id"), timestamps("updatedAt")))
+    return [r for r, k in zip(records, keep) if k]
+
+
+def reached_since(records, since) -> bool:
+    """Vrai si la page contient des enregistrements créés avant `since`."""
+    if since is None:
+        return False
+    created = pd.to_datetime([r.get("createdAt") for r in records], errors="coerce", utc=True)
+    return bool((created < since).any())
+
+
+def map_unique(values, func) -> list:
+    """Applique `func` une seule fois par valeur distincte d'un lot (mappings opérateur, antenne...)."""
+    cache = {}
+    out = []
+    for v in values:
+        if v not in cache:
+            cache[v] = func(v)
+        out.append(cache[v])
+    return out
+
+
+def ingest_pages(pages, build_page) -> pd.DataFrame:
+    """Construit le DataFrame colonne par colonne, page après page.
+
+    `build_page` transforme une page JSON en colonnes typées et enrichies (nom →
+    Series) : la page brute est libérée dès qu'elle est consommée, sans dict
+    intermédiaire par enregistrement. Les morceaux sont ensuite concaténés et
+    libérés colonne par colonne, pour que le pic mémoire reste proche du DataFrame final.
+    """
+    buffers = {}
+    for records in pages:
+        for name, values in build_page(records).items():
+            buffers.setdefault(name, []).append(values)
+    if not buffers:
+        return pd.DataFrame()
+    columns = {}
+    for name in list(buffers):
+        parts = buffers.pop(name)
+        columns[name] = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
 
-            all_records.append(rd)
 
-        if current_page >= data.get("lastPage", 1):
-            break
-        current_page += 1
+def page_columns(records):
+    """Accesseurs colonne d'une page Ksaar : valeurs brutes et horodatages ISO (UTC)."""
+    def field(name, default=None) -> pd.Series:
+        return pd.Series([r.get(name, default) for r in records])
 
-    if not all_records:
-        st.warning("Ksaar : la requête Chats a réussi mais aucun enregistrement n'a été retourné.")
-        return pd.DataFrame()
+    def timestamps(name) -> pd.Series:
+        return pd.to_datetime(field(name), format="ISO8601", errors="coerce", utc=True)
 
-    df = pd.DataFrame(all_records)
+    return field, timestamps
 
-    for col in ["Crée le", "Modifié le", "pnd_time", "last_user_message", "last_op_message"]:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors="coerce")
 
-    df["messages"] = df["messages"].astype(str)
-    df["messages_lower"] = df["messages"].str.lower()
+def chats_page(records, pattern) -> dict:
+    """Colonnes d'une page de chats, enrichies et pré-scorées en lot."""
+    field, timestamps = page_columns(records)
+    operators = map_unique([r.get("Opérateur ID (API) 1") for r in records], get_operator_name)
+    origins = zip(
+        [r.get("Message système 1", "") for r in records],
+        [r.get("Département Origine 2", "") for r in records],
+    )
+    messages = field("Conversation complète 2", "").astype(str)
+    scores = messages.str.lower().map(lambda text: len(pattern.findall(text)) if text else 0)
+    return {
+        "ksaar_id": field("id"),
+        "Crée le": timestamps("createdAt"),
+        "Modifié le": timestamps("updatedAt"),
+        "IP": field("IP 2", ""),
+        "pnd_time": timestamps("Date complète début 2"),
+        "id_chat": field("Chat ID 2"),
+        "last_user_message": timestamps("Date complète fin 2"),
+        "last_op_message": timestamps("Date complète début 2"),
+        "Message système 1": field("Message système 1", ""),
+        "Département Origine 2": field("Département Origine 2", ""),
+        "Operateur_Name": pd.Series(operators),
+        "Volunteer_Location": pd.Series(map_unique(operators, get_volunteer_location)),
+        "Antenne": pd.Series(map_unique(origins, lambda o: get_normalized_antenne(extract_antenne(*o)))),
+        "potentially_abusive": scores > 0,
+        "preliminary_score": scores,
+        # les transcripts ne restent en mémoire que compressés ; décompression à la
+        # demande (détail, export, recherche, index) via decompress_transcript()
+        "messages_z": pd.Series([compress_transcript(m) for m in messages], dtype=TRANSCRIPT_DTYPE),
+    }
 
-    def is_abusive(text: str) -> bool:
-        if not text:
-            return False
-        return bool(pattern.search(text))
 
-    df["potentially_abusive"] = df["messages_lower"].apply(is_abusive)
+def fetch_ksaar_chats(since=None, known=None):
+    """Récupère les chats + pré-calcul des flags abusifs.
 
-    def abuse_score(text: str) -> int:
-        if not text:
-            return 0
-        matches = pattern.findall(text)
-        return len(matches)
+    Avec `since`, s'arrête à la première page contenant des chats créés avant
+    cette date (les pages sont triées du plus récent au plus ancien) ; les chats
+    plus anciens ou déjà connus (`known`) ne sont ni scorés ni compressés. Lève
+    KsaarCrawlError si le crawl est interrompu.
+    """
+    if not ksaar_config.get("api_base_url"):
+        st.error("API base URL non configurée (secrets.ksaar_config.api_base_url manquant).")
+        return pd.DataFrame()
 
-    df["preliminary_score"] = df["messages_lower"].apply(abuse_score)
+    workflow_id = "1500d159-5185-4487-be1f-fa18c6c85ec5"  # chats
+    pattern, abuse_keywords = compile_abuse_patterns()
+    pages = iter_ksaar_pages(workflow_id, "Chats", since, known)
+    df = ingest_pages(pages, lambda records: chats_page(records, pattern))
 
+    if df.empty and since is None:
+        st.warning("Ksaar : la requête Chats a réussi mais aucun enregistrement n'a été retourné.")
     return df
 
 
+def calls_page(records) -> dict:
+    """Colonnes d'une page d'appels, avec antenne et durées calculées en lot."""
+    field, timestamps = page_columns(records)
+    from_dst = map_unique([r.get("dst", "") for r in records], get_antenne_from_dst)
+    from_name = map_unique(
+        [r.get("from_name") for r in records], lambda name: get_normalized_antenne(name) if name else "Inconnue"
+    )
+    created, answered, ended = timestamps("createdAt"), timestamps("answer"), timestamps("end")
+    return {
+        "ksaar_id": field("id"),
+        "Crée le": created,
+        "Modifié le": timestamps("updatedAt"),
+        "Nom": field("from_name", ""),
+        "Numéro": field("from_number", ""),
+        "Statut": field("disposition", ""),
+        "Code_de_cloture": field("Code_de_cloture", ""),
+        "Décroché le": answered,
+        "Terminé le": ended,
+        "dst": field("dst", ""),
+        "Antenne": pd.Series([a or n for a, n in zip(from_dst, from_name)]),
+        "Début appel": answered.dt.strftime("%H:%M"),
+        "Fin appel": ended.dt.strftime("%H:%M"),
+        "Durée (s)": (ended - answered).dt.total_seconds(),
+        "Attente (s)": (answered - created).dt.total_seconds(),
+    }
+
 
-@st.cache_data(ttl=600)
-def get_ksaar_calls():
-    """Récupère les appels."""
+def fetch_ksaar_calls(since=None, known=None):
+    """Récupère les appels (du plus récent au plus ancien, arrêt à `since` si fourni)."""
     if not ksaar_config.get("api_base_url"):
         st.error("API base URL non configurée (secrets.ksaar_config.api_base_url manquant).")
         return pd.DataFrame()
 
     workflow_id = "deb92463-c3a5-4393-a3bf-1dd29a022cfe"  # appels
-    url = f"{ksaar_config['api_base_url']}/v1/workflows/{workflow_id}/records"
-    auth = (ksaar_config["api_key_name"], ksaar_config["api_key_password"])
+    df = ingest_pages(iter_ksaar_pages(workflow_id, "Appels", since, known), calls_page)
 
-    all_records = []
-    current_page = 1
+    if df.empty and since is None:
+        st.warning("Ksaar : la requête Appels a réussi mais aucun enregistrement n'a été retourné.")
 
-    def extract_time(ts):
-        if not ts:
-            return None
+    # ⚠️ TEMPORAIREMENT : on enlève le filtre sur 2025
+    # df = df[df["Crée le"] >= "2025-01-01"]
+
+    return df
+
+
+# ==========================
+# STOCKAGE PARTAGÉ (MULTI-RÉPLIQUES)
+# ==========================
+
+class SharedStore:
+    """Stockage SQLite (mode WAL) sur un volume partagé entre répliques.
+
+    Une seule réplique (élue via un bail en base) ou un job externe crawle Ksaar et
+    écrit ; toutes les répliques lisent. Chaque écriture incrémente la version du
+    jeu de données et marque les lignes touchées avec cette version : la détection
+    de changement tient en une requête et les lecteurs ne relisent que le delta.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.holder = f"{socket.gethostname()}-{os.getpid()}"
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS datasets (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    base_version INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    resynced_at REAL NOT NULL,
+                    schema TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
         try:
-            dt = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S.%fZ")
-            return dt.strftime("%H:%M")
-        except Exception:
+            con.execute("PRAGMA busy_timeout=30000")
+            yield con
+        finally:
+            con.close()
+
+    def info(self, name: str):
+        """État du jeu de données (version, base_version, updated_at, resynced_at) ou None."""
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT version, base_version, updated_at, resynced_at FROM datasets WHERE name = ?",
+                (name,),
+            ).fetchone()
+        if row is None:
             return None
+        return dict(zip(["version", "base_version", "updated_at", "resynced_at"], row))
+
+    def mark_stale(self, name: str):
+        """Force un crawl complet au prochain passage de l'écrivain."""
+        with self._connect() as con:
+            con.execute("UPDATE datasets SET updated_at = 0, resynced_at = 0 WHERE name = ?", (name,))
+
+    def try_acquire_lease(self, name: str, ttl: float) -> bool:
+        """Élection de l'écrivain : le bail est pris si libre, expiré ou déjà détenu."""
+        now = time.time()
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute(
+                "SELECT holder, expires_at FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+            acquired = row is None or row[0] == self.holder or row[1] < now
+            if acquired:
+                con.execute(
+                    "INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                    (name, self.holder, now + ttl),
+                )
+            con.execute("COMMIT")
+        return acquired
 
-    while True:
-        params = {"page": current_page, "limit": 100}
+    def release_lease(self, name: str):
+        with self._connect() as con:
+            con.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, self.holder))
+
+    def watermark(self, name: str):
+        """Date de création la plus récente stockée (pour le crawl incrémental)."""
+        with self._connect() as con:
+            try:
+                row = con.execute(f'SELECT max("Crée le") FROM "ds_{name}"').fetchone()
+            except sqlite3.OperationalError:
+                return None
+        return pd.to_datetime(row[0], format="ISO8601", utc=True) if row and row[0] else None
+
+    @staticmethod
+    def _serialize(df: pd.DataFrame):
+        schema = {}
+        out = df.copy(deep=False)
+        for col in out.columns:
+            if pd.api.types.is_datetime64_any_dtype(out[col]):
+                schema[col] = "datetime"
+                out[col] = out[col].dt.strftime("%Y-%m-%dT%H:%M:%S.%f%z")
+            elif pd.api.types.is_bool_dtype(out[col]):
+                schema[col] = "bool"
+        return out, schema
+
+    @staticmethod
+    def _deserialize(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+        df = df.drop(columns=["_version"], errors="ignore")
+        for col, kind in schema.items():
+            if kind == "datetime":
+                df[col] = pd.to_datetime(df[col], format="ISO8601", errors="coerce")
+            elif kind == "bool":
+                df[col] = df[col].astype(bool)
+        if "messages" in df.columns:  # store écrit avant la compression des transcripts
+            df["messages_z"] = [compress_transcript(m) for m in df.pop("messages").astype(str)]
+            df = df.drop(columns=["messages_lower"], errors="ignore")
+        if "messages_z" in df.columns:
+            df["messages_z"] = df["messages_z"].astype(TRANSCRIPT_DTYPE)
+        return df
+
+    def write(self, name: str, df: pd.DataFrame, key: str):
+        """Remplace le jeu de données de façon atomique (les lecteurs voient l'ancien ou le nouveau)."""
+        table = f"ds_{name}"
+        out, schema = self._serialize(df)
+        with self._connect() as con:
+            # la table de travail est remplie dans sa propre transaction, puis échangée
+            con.execute("BEGIN")
+            out.to_sql(f"{table}_new", con, if_exists="replace", index=False)
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT version FROM datasets WHERE name = ?", (name,)).fetchone()
+            version = (row[0] if row else 0) + 1
+            now = time.time()
+            con.execute(f'ALTER TABLE "{table}_new" ADD COLUMN _version INTEGER NOT NULL DEFAULT {version}')
+            con.execute(f'DROP TABLE IF EXISTS "{table}"')
+            con.execute(f'ALTER TABLE "{table}_new" RENAME TO "{table}"')
+            con.execute(f'CREATE INDEX "{table}_key" ON "{table}" ({sql_ident(key)})')
+            con.execute(f'CREATE INDEX "{table}_version" ON "{table}" (_version)')
+            con.execute(
+                "INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?)",
+                (name, version, version, now, now, json.dumps(schema)),
+            )
+            con.execute("COMMIT")
+
+    def upsert(self, name: str, df: pd.DataFrame, key: str) -> bool:
+        """Insère / remplace les lignes de `df` par clé. False si un `write` complet est nécessaire."""
+        table = f"ds_{name}"
+        out, schema = self._serialize(df)
+        with self._connect() as con:
+            con.execute("BEGIN")
+            out.to_sql(f"{table}_stage", con, if_exists="replace", index=False)
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute("SELECT version, schema FROM datasets WHERE name = ?", (name,)).fetchone()
+            columns = {r[1] for r in con.execute(f'PRAGMA table_info("{table}")')}
+            if row is None or json.loads(row[1]) != schema or columns != set(out.columns) | {"_version"}:
+                con.execute("ROLLBACK")
+                return False
+            version = row[0] + 1
+            cols = ", ".join(sql_ident(c) for c in out.columns)
+            con.execute(
+                f'DELETE FROM "{table}" WHERE {sql_ident(key)} IN (SELECT {sql_ident(key)} FROM "{table}_stage")'
+            )
+            con.execute(f'INSERT INTO "{table}" ({cols}, _version) SELECT {cols}, ? FROM "{table}_stage"', (version,))
+            con.execute("UPDATE datasets SET version = ?, updated_at = ? WHERE name = ?", (version, time.time(), name))
+            con.execute(f'DROP TABLE "{table}_stage"')
+            con.execute("COMMIT")
+        return True
+
+    def touch(self, name: str):
+        """Crawl effectué sans changement : repousse simplement la prochaine échéance."""
+        with self._connect() as con:
+            con.execute("UPDATE datasets SET updated_at = ? WHERE name = ?", (time.time(), name))
+
+    def read(self, name: str, since_version=None):
+        """(lignes, version) : tout le jeu, ou seulement les lignes modifiées après `since_version`."""
+        with self._connect() as con:
+            con.execute("BEGIN")
+            row = con.execute("SELECT version, schema FROM datasets WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                con.execute("COMMIT")
+                return pd.DataFrame(), None
+            if since_version is None:
+                df = pd.read_sql_query(f'SELECT * FROM "ds_{name}"', con)
+            else:
+                df = pd.read_sql_query(f'SELECT * FROM "ds_{name}" WHERE _version > ?', con, params=(since_version,))
+            con.execute("COMMIT")
+        return self._deserialize(df, json.loads(row[1])), row[0]
+
+
+@st.cache_resource
+def get_shared_store():
+    """Store partagé si `ksaar_config.shared_store_path` est configuré, sinon None."""
+    path = ksaar_config.get("shared_store_path")
+    if not path:
+        return None
+    return SharedStore(path)
+
+
+def sync_shared_store():
+    """Point d'entrée du job externe : `python app.py --sync-store`."""
+    if get_shared_store() is None:
+        print("shared_store_path non configuré (secrets.ksaar_config).")
+        return
+    for feed in [chats_feed(), calls_feed()]:
         try:
-            resp = requests.get(url, params=params, auth=auth, timeout=30)
-        except Exception as e:
-            st.error(f"Erreur de connexion à l'API Appels : {e}")
-            break
+            published = feed.publish_to_store(force=True)
+        except KsaarCrawlError as e:
+            print(f"{feed.name} : crawl interrompu, store inchangé ({e})")
+            continue
+        info = get_shared_store().info(feed.name)
+        if not published:
+            print(f"{feed.name} : rien publié (rôle lecteur ou bail détenu par une autre réplique)")
+        elif info is None:
+            print(f"{feed.name} : rien publié (crawl vide)")
+        else:
+            print(f"{feed.name} : version {info['version']}")
 
-        if resp.status_code != 200:
-            st.error(f"Erreur API Appels (status {resp.status_code}) pour la page {current_page}")
+
+# ==========================
+# JEUX DE DONNÉES PARTAGÉS
+# ==========================
+
+class SharedDataset:
+    """Jeu de données chargé une fois par process et partagé entre toutes les sessions.
+
+    Le DataFrame interne n'est jamais modifié : les sessions reçoivent des vues
+    (copies superficielles en copy-on-write), donc ajouter des utilisateurs ou des
+    reruns ne duplique pas les données en mémoire.
+
+    Les requêtes DuckDB lisent une table Arrow construite sans copie à partir du
+    DataFrame (mêmes buffers) : `nbytes` compte le DataFrame plus ce qu'Arrow a
+    dû allouer en propre (bitmaps des booléens).
+
+    Une version issue d'une ingestion incrémentale est publiée comme une base (version
+    déjà fusionnée) plus des correctifs (lignes nouvelles / modifiées depuis). La
+    fusion, en O(n), n'a lieu qu'au premier accès aux données, hors du verrou du
+    flux : publier une version ne coûte que O(delta).
+    """
+
+    def __init__(self, name: str, frame, version=None, key="ksaar_id", base=None, patches=()):
+        self.name = name
+        self.key = key
+        self.version = version
+        self.loaded_at = datetime.now()
+        self._frame = frame
+        self._base = base
+        self._patches = tuple(patches)
+        self._keys = None
+        self._arrow = None
+        self._arrow_nbytes = 0
+        self._nbytes = None
+        self._lock = threading.Lock()
+
+    @property
+    def empty(self) -> bool:
+        # une version à correctifs contient au moins son dernier delta
+        return self._frame is not None and self._frame.empty
+
+    @property
+    def materialized(self) -> bool:
+        return self._frame is not None
+
+    def frame(self) -> pd.DataFrame:
+        if self._frame is None:
+            with self._lock:
+                if self._frame is None:
+                    self._frame, self._keys = self._merge()
+                    self._base, self._patches = None, ()
+        return self._frame
+
+    def _merge(self):
+        """Base + correctifs (le plus récent l'emporte), triés comme un chargement complet."""
+        base = self._base.frame()
+        delta = pd.concat(self._patches, ignore_index=True).drop_duplicates(self.key, keep="last")
+        replaced = self._base.keys().get_indexer(delta[self.key])
+        keep = np.ones(len(base), dtype=bool)
+        keep[replaced[replaced >= 0]] = False
+        frame = pd.concat([delta, base[keep]], ignore_index=True)
+        frame = frame.sort_values("Crée le", ascending=False, kind="stable", ignore_index=True)
+        return frame, pd.Index(frame[self.key])
+
+    def keys(self) -> pd.Index:
+        """Clés dans l'ordre des lignes : `keys().get_indexer(k)` donne leurs positions."""
+        frame = self.frame()
+        if self._keys is None:
+            with self._lock:
+                if self._keys is None:
+                    self._keys = pd.Index(frame[self.key])
+        return self._keys
+
+    @property
+    def nbytes(self) -> int:
+        """Mémoire résidente : DataFrame + allocations propres à la table Arrow (si construite)."""
+        if self._nbytes is None:
+            frame = self.frame()
+            self._nbytes = int(frame.memory_usage(deep=True).sum()) if not frame.empty else 0
+        return self._nbytes + self._arrow_nbytes
+
+    def view(self) -> pd.DataFrame:
+        """Vue bon marché pour une session (aucune copie des colonnes)."""
+        return self.frame().copy(deep=False)
+
+    def arrow(self) -> pa.Table:
+        """Table Arrow immuable, construite à la première demande.
+
+        Les colonnes numériques, dates, chaînes et transcripts (TRANSCRIPT_DTYPE)
+        sont des vues sur les buffers du DataFrame ; l'écart d'allocation du pool
+        Arrow mesure ce qui reste en propre à la table.
+        """
+        if self._arrow is None:
+            frame = self.frame()
+            with self._lock:
+                if self._arrow is None:
+                    allocated = pa.total_allocated_bytes()
+                    table = pa.Table.from_pandas(frame, preserve_index=False)
+                    self._arrow_nbytes = max(pa.total_allocated_bytes() - allocated, 0)
+                    self._arrow = table
+        return self._arrow
+
+
+INGEST_OVERLAP = timedelta(hours=48)  # fenêtre recrawlée pour capter les chats / appels modifiés
+FULL_RESYNC_EVERY = 24 * 3600  # crawl complet de réconciliation (secondes)
+PENDING_PATCHES_MAX = 32  # correctifs non fusionnés au-delà desquels l'ingestion fusionne elle-même
+
+
+class DatasetFeed:
+    """Ingestion incrémentale d'un jeu de données Ksaar, une fois par process.
+
+    Chaque rafraîchissement ne recrawle que les pages récentes (depuis le dernier
+    enregistrement connu moins INGEST_OVERLAP), ne garde que les lignes nouvelles ou
+    modifiées, les fusionne par clé et publie un nouveau SharedDataset. Les
+    structures dérivées (agrégats, index...) s'abonnent via `subscribe` et ne
+    reçoivent que ce delta : `apply(added, removed)`, ou `reset()` après un crawl
+    complet. Avec le store partagé, seul l'écrivain élu crawle ; les autres
+    répliques relisent uniquement les lignes modifiées depuis leur version.
+
+    Une ingestion incrémentale coûte O(delta) : les versions précédentes des lignes
+    reçues sont retrouvées par clé (`SharedDataset.keys`) et le delta est publié
+    comme correctif de la dernière version fusionnée (`base`).
+    """
+
+    def __init__(self, name: str, key: str, fetch, ttl: float):
+        self.name = name
+        self.key = key
+        self.fetch = fetch
+        self.ttl = ttl
+        self.dataset = SharedDataset(name, pd.DataFrame(), 0, key)
+        self.base = self.dataset
+        self.patches = []
+        self.latest = None  # date de création la plus récente connue
+        self.listeners = []
+        self.indexes = {}
+        self.lock = threading.RLock()
+        self.refreshed_at = 0.0
+        self.resynced_at = 0.0
+        self.store_version = None
+
+    def subscribe(self, listener, name=None):
+        """Abonne une structure dérivée (retrouvable via `indexes[name]`) et lui rejoue le jeu courant."""
+        with self.lock:
+            self.listeners.append(listener)
+            if name is not None:
+                self.indexes[name] = listener
+            if not self.dataset.empty:
+                listener.apply(self.dataset.view(), self.dataset.view().iloc[0:0])
+        return listener
+
+    def current(self) -> SharedDataset:
+        """Jeu de données courant, rafraîchi si périmé (sans bloquer si un autre thread s'en charge)."""
+        if time.time() - self.refreshed_at > self._check_interval():
+            if self.lock.acquire(blocking=self.dataset.empty):
+                try:
+                    if time.time() - self.refreshed_at > self._check_interval():
+                        self.refresh()
+                finally:
+                    self.lock.release()
+        return self.dataset
+
+    def _check_interval(self) -> float:
+        # avec le store, la détection de changement ne coûte qu'un SELECT : on vérifie à chaque rerun
+        return 0.0 if get_shared_store() is not None else self.ttl
+
+    def reset(self):
+        """Oublie l'état local : le prochain accès refait un chargement complet."""
+        with self.lock:
+            store = get_shared_store()
+            if store is not None:
+                store.mark_stale(self.name)
+            self.refreshed_at = 0.0
+            self.resynced_at = 0.0
+            self.store_version = None
+
+    def refresh(self, full=None, overlap=INGEST_OVERLAP):
+        with self.lock:
             try:
-                st.text(f"Réponse brute : {resp.text[:500]}")
-            except Exception:
-                pass
-            break
+                if get_shared_store() is None:
+                    full = self._resync_due() if full is None else full
+                    if full:
+                        delta = self.fetch()
+                    else:
+                        delta = self.fetch(since=self._since(overlap), known=self._unchanged)
+                    self._apply(delta, full)
+                else:
+                    self.publish_to_store()
+            except KsaarCrawlError as e:
+                # version publiée (et store) conservés ; un crawl complet manqué reste dû
+                print(f"{self.name} : crawl interrompu, données précédentes conservées ({e})", file=sys.stderr)
+            if get_shared_store() is not None:
+                self._pull_from_store()
+            self.refreshed_at = time.time()
+
+    def _resync_due(self) -> bool:
+        return self.dataset.empty or time.time() - self.resynced_at > FULL_RESYNC_EVERY
+
+    def _since(self, overlap):
+        return None if self.latest is None or pd.isna(self.latest) else self.latest - overlap
+
+    def _track_latest(self, created: pd.Series):
+        latest = created.max()
+        if pd.notna(latest) and (self.latest is None or pd.isna(self.latest) or latest > self.latest):
+            self.latest = latest
+
+    def _apply(self, delta: pd.DataFrame, full: bool):
+        """Fusionne le delta par clé, publie la nouvelle version et notifie les abonnés."""
+        if full:
+            self.resynced_at = time.time()
+        if delta.empty:
+            return  # rien de neuf (ou crawl en échec : on garde les données précédentes)
+
+        delta = delta.drop_duplicates(self.key, keep="first")
+        version = self.dataset.version + 1
+        if full or self.dataset.empty:
+            frame = delta.sort_values("Crée le", ascending=False, kind="stable", ignore_index=True)
+            self.dataset = self.base = SharedDataset(self.name, frame, version, self.key)
+            self.patches = []
+            self.latest = None
+            self._track_latest(frame["Crée le"])
+            for listener in self.listeners:
+                listener.reset()
+            self._notify(frame, frame.iloc[0:0])  # mêmes buffers que la version publiée
+            return
 
-        data = resp.json()
-        records = data.get("results", [])
-        if not records:
-            # st.info(f"Aucun enregistrement d'appel pour la page {current_page}.")
-            break
+        previous = self._current_rows(delta[self.key])
+        delta = delta[~self._unchanged(delta[self.key], delta["Modifié le"], previous)]
+        if delta.empty:
+            return
+        removed = previous[previous[self.key].isin(delta[self.key]).to_numpy()]
+
+        self._compact()
+        self.patches.append(delta)
+        self.dataset = SharedDataset(self.name, None, version, self.key, base=self.base, patches=self.patches)
+        self._track_latest(delta["Crée le"])
+        self._notify(delta, removed)
+
+    def _unchanged(self, keys: pd.Series, updated: pd.Series, previous=None) -> np.ndarray:
+        """Masque des enregistrements déjà publiés avec la même date de modification."""
+        if previous is None:
+            previous = self._current_rows(keys)
+        before = previous.drop_duplicates(self.key).set_index(self.key)["Modifié le"].reindex(keys)
+        return before.to_numpy() == updated.to_numpy()  # NaT (ligne nouvelle) : jamais égal
+
+    def _current_rows(self, keys: pd.Series) -> pd.DataFrame:
+        """Version publiée des lignes de clés `keys` (celles qui existent), sans parcourir l'historique."""
+        parts = []
+        for patch in reversed(self.patches):
+            pos = pd.Index(patch[self.key]).get_indexer(keys)
+            parts.append(patch.take(pos[pos >= 0]))
+            keys = keys[pos < 0]
+        pos = self.base.keys().get_indexer(keys)
+        parts.append(self.base.frame().take(pos[pos >= 0]))
+        return pd.concat(parts, ignore_index=True)
+
+    def _compact(self):
+        """Adopte la dernière version fusionnée (par une session) comme nouvelle base.
+
+        Si personne ne lit les données, les correctifs s'accumulent : passé
+        PENDING_PATCHES_MAX, la fusion est faite ici (coût amorti sur autant d'ingestions).
+        """
+        if not self.dataset.materialized and len(self.patches) >= PENDING_PATCHES_MAX:
+            self.dataset.frame()
+        if self.dataset.materialized and self.dataset is not self.base:
+            self.base, self.patches = self.dataset, []
+
+    def _notify(self, added: pd.DataFrame, removed: pd.DataFrame):
+        """Transmet le delta à chaque abonné, isolément.
+
+        Un abonné en échec ne prive pas les suivants du delta : il est vidé puis
+        reconstruit sur le jeu publié, ou laissé vide (et cohérent) si la
+        reconstruction échoue aussi, plutôt que de rester à moitié à jour.
+        """
+        for listener in self.listeners:
+            try:
+                listener.apply(added, removed)
+            except Exception as e:
+                print(f"{self.name} : abonné {type(listener).__name__} en échec ({e!r}), reconstruction", file=sys.stderr)
+                listener.reset()
+                try:
+                    listener.apply(self.dataset.view(), self.dataset.view().iloc[0:0])
+                except Exception as e:
+                    listener.reset()
+                    print(f"{self.name} : reconstruction de {type(listener).__name__} impossible ({e!r})", file=sys.stderr)
+
+    def publish_to_store(self, force=False) -> bool:
+        """Écrivain élu : crawle Ksaar (delta ou complet) et publie dans le store partagé.
+
+        Renvoie False si cette réplique n'a pas crawlé (store à jour, rôle lecteur, bail pris).
+        """
+        store = get_shared_store()
+        info = store.info(self.name)
+        now = time.time()
+        is_stale = info is None or now - info["updated_at"] > self.ttl
+        if not (force or is_stale) or ksaar_config.get("shared_store_role", "auto") == "reader":
+            return False
+        if not store.try_acquire_lease(self.name, ttl=max(self.ttl, 120)):
+            return False
+        try:
+            watermark = store.watermark(self.name)
+            full = info is None or watermark is None or now - info["resynced_at"] > FULL_RESYNC_EVERY
+            delta = self.fetch(since=None if full else watermark - INGEST_OVERLAP)
+            if delta.empty:
+                if info is not None:
+                    store.touch(self.name)
+            elif full:
+                store.write(self.name, delta, self.key)
+            elif not store.upsert(self.name, delta, self.key):
+                store.write(self.name, self.fetch(), self.key)  # schéma modifié : réécriture complète
+        finally:
+            store.release_lease(self.name)
+        return True
 
-        for record in records:
-            dst = record.get("dst", "")
-            rec = {
-                "Crée le": record.get("createdAt"),
-                "Nom": record.get("from_name", ""),
-                "Numéro": record.get("from_number", ""),
-                "Statut": record.get("disposition", ""),
-                "Code_de_cloture": record.get("Code_de_cloture", ""),
-                "Début appel": extract_time(record.get("answer")),
-                "Fin appel": extract_time(record.get("end")),
-                "dst": dst,
-            }
+    def _pull_from_store(self):
+        store = get_shared_store()
+        info = store.info(self.name)
+        if info is None or info["version"] == self.store_version:
+            return
+        if self.store_version is None or self.store_version < info["base_version"]:
+            frame, version = store.read(self.name)
+            self._apply(frame, full=True)
+        else:
+            delta, version = store.read(self.name, since_version=self.store_version)
+            self._apply(delta, full=False)
+        self.store_version = version
 
-            antenne_from_dst = get_antenne_from_dst(dst)
-            if antenne_from_dst:
-                rec["Antenne"] = antenne_from_dst
-            elif record.get("from_name"):
-                rec["Antenne"] = get_normalized_antenne(record["from_name"])
-            else:
-                rec["Antenne"] = "Inconnue"
 
-            all_records.append(rec)
+def frame_nbytes(df: pd.DataFrame) -> int:
+    if df is None or df.empty:
+        return 0
+    return int(df.memory_usage(deep=True).sum())
 
-        if current_page >= data.get("lastPage", 1):
-            break
-        current_page += 1
 
-    if not all_records:
-        st.warning("Ksaar : la requête Appels a réussi mais aucun enregistrement n'a été retourné.")
+def process_rss_bytes():
+    """Mémoire résidente du process (Linux), None si indisponible."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def format_bytes(n) -> str:
+    if n is None:
+        return "N/A"
+    for unit in ["o", "Ko", "Mo", "Go"]:
+        if abs(n) < 1024 or unit == "Go":
+            return f"{n:.0f} {unit}" if unit == "o" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def track_session_frame(key: str, df: pd.DataFrame):
+    """Mémorise la taille des frames propres à la session (résultats de filtres...)."""
+    st.session_state.setdefault("session_frames_bytes", {})[key] = frame_nbytes(df)
+
+
+def display_memory_report():
+    """Mémoire partagée (une fois par process) vs mémoire propre à la session."""
+    shared = [current_chats_dataset(), current_calls_dataset()]
+    session_frames = st.session_state.get("session_frames_bytes", {})
+    with st.sidebar.expander("💾 Mémoire", expanded=False):
+        for ds in shared:
+            version = f", version {ds.version}" if ds.version is not None else ""
+            st.write(f"**Partagé – {ds.name} :** {format_bytes(ds.nbytes)} (chargé à {ds.loaded_at.strftime('%H:%M:%S')}{version})")
+        st.write(f"**Session courante :** {format_bytes(sum(session_frames.values()))}")
+        for key, nbytes in session_frames.items():
+            st.caption(f"{key} : {format_bytes(nbytes)}")
+        st.write(f"**Process (RSS) :** {format_bytes(process_rss_bytes())}")
+
+
+# ==========================
+# AGRÉGATS INCRÉMENTAUX (ROLLUPS)
+# ==========================
+
+class Rollup:
+    """Comptages pré-agrégés par heure et par jour, maintenus incrémentalement.
+
+    Abonné à un DatasetFeed : chaque ingestion ajoute les lignes nouvelles et retire
+    les anciennes versions des lignes remplacées, sans relire l'historique brut.
+    Les vues KPI / tendances interrogent ces tables, dont la taille dépend du nombre
+    de créneaux × dimensions et non du nombre d'enregistrements.
+    """
+
+    FREQS = {"heure": "h", "jour": "D"}
+
+    def __init__(self, time_col: str, dims, fill="(vide)"):
+        self.time_col = time_col
+        self.dims = list(dims)
+        self.fill = fill
+        self.reset()
+
+    def reset(self):
+        self.tables = {name: pd.Series(dtype="int64") for name in self.FREQS}
+
+    def _aggregate(self, rows: pd.DataFrame, freq: str) -> pd.Series:
+        if rows.empty:
+            return pd.Series(dtype="int64")
+        keys = [rows[self.time_col].dt.floor(freq).rename("bucket")]
+        keys += [rows[d].astype(object).where(rows[d].notna(), self.fill) for d in self.dims]
+        return rows.groupby(keys).size()
+
+    def apply(self, added: pd.DataFrame, removed: pd.DataFrame):
+        for name, freq in self.FREQS.items():
+            parts = [self.tables[name], self._aggregate(added, freq), -self._aggregate(removed, freq)]
+            parts = [p for p in parts if not p.empty]
+            if not parts:
+                continue
+            merged = pd.concat(parts)
+            merged = merged.groupby(level=list(range(merged.index.nlevels))).sum()
+            self.tables[name] = merged[merged != 0]
+
+    def query(self, freq="jour", start=None, end=None, by=(), **filters) -> pd.Series:
+        """Comptes par créneau (et par `by`) sur [start, end[, filtrés par dimension.
+
+            rollup.query("jour", start, end, by=["Statut"], Antenne=["Paris"])
+        """
+        table = self.tables[freq]
+        if table.empty:
+            names = ["bucket", *by]
+            return pd.Series(dtype="int64", index=pd.MultiIndex.from_arrays([[]] * len(names), names=names))
+        idx = table.index
+        mask = np.ones(len(table), dtype=bool)
+        if start is not None:
+            mask &= idx.get_level_values("bucket") >= start
+        if end is not None:
+            mask &= idx.get_level_values("bucket") < end
+        for dim, values in filters.items():
+            mask &= idx.get_level_values(dim).isin(values)
+        return table[mask].groupby(level=["bucket", *by]).sum()
+
+
+class QuantileSketches:
+    """Histogrammes logarithmiques (type DDSketch) par nuit et par antenne, fusionnables.
+
+    Chaque valeur tombe dans le bin ceil(log_gamma(x)) : tout quantile lu dans un
+    bin est à ALPHA près en valeur relative. Les sketchs sont de simples comptes par
+    (mesure, nuit, antenne, bin) : ajouter un chat incrémente, retirer l'ancienne
+    version d'un chat modifié décrémente, et la fusion d'une plage de nuits ou
+    d'antennes est une somme (contrairement à un t-digest, qui ne sait pas retirer).
+
+    Mesures : attente avant la prise en charge (pnd_time, 1er message opérateur,
+    moins Crée le) et durée du chat (last_user_message moins pnd_time), en secondes.
+    """
+
+    ALPHA = 0.01
+    GAMMA = (1 + ALPHA) / (1 - ALPHA)
+    METRICS = {
+        "Attente (s)": ("Crée le", "pnd_time"),
+        "Durée (s)": ("pnd_time", "last_user_message"),
+    }
+    NIGHT_SHIFT = pd.Timedelta(hours=12)  # une nuit court de midi à midi (UTC)
+
+    def __init__(self, time_col="Crée le", dim="Antenne", fill="(vide)"):
+        self.time_col = time_col
+        self.dim = dim
+        self.fill = fill
+        self.reset()
+
+    def reset(self):
+        self.table = pd.Series(dtype="int64")
+
+    def _aggregate(self, rows: pd.DataFrame) -> pd.Series:
+        parts = []
+        for metric, (start_col, end_col) in self.METRICS.items():
+            seconds = (rows[end_col] - rows[start_col]).dt.total_seconds()
+            ok = (seconds >= 0).to_numpy()
+            if not ok.any():
+                continue
+            values = seconds.to_numpy()[ok]
+            bins = np.ceil(np.log(np.maximum(values, 1.0)) / np.log(self.GAMMA)).astype(np.int32)
+            keys = pd.DataFrame({
+                "metric": metric,
+                "night": (rows[self.time_col][ok] - self.NIGHT_SHIFT).dt.floor("D").to_numpy(),
+                self.dim: rows[self.dim][ok].astype(object).where(rows[self.dim][ok].notna(), self.fill).to_numpy(),
+                "bin": bins,
+            })
+            parts.append(keys.groupby(list(keys.columns)).size())
+        return pd.concat(parts) if parts else pd.Series(dtype="int64")
+
+    def apply(self, added: pd.DataFrame, removed: pd.DataFrame):
+        parts = [self.table, self._aggregate(added), -self._aggregate(removed)]
+        parts = [p for p in parts if not p.empty]
+        if not parts:
+            return
+        merged = pd.concat(parts)
+        merged = merged.groupby(level=list(range(merged.index.nlevels))).sum()
+        self.table = merged[merged != 0]
+
+    def quantiles(self, metric: str, start=None, end=None, by=(), qs=(0.5, 0.9, 0.99), **filters) -> pd.DataFrame:
+        """Effectif et quantiles de `metric` par `by` ("night" et/ou la dimension), nuits dans [start, end[."""
+        if self.table.empty:
+            return pd.DataFrame()
+        idx = self.table.index
+        mask = idx.get_level_values("metric") == metric
+        if start is not None:
+            mask &= idx.get_level_values("night") >= start
+        if end is not None:
+            mask &= idx.get_level_values("night") < end
+        for dim, values in filters.items():
+            mask &= idx.get_level_values(dim).isin(values)
+        counts = self.table[mask]
+        if counts.empty:
+            return pd.DataFrame()
+        # fusion des sketchs : somme des comptes par bin dans chaque groupe
+        merged = counts.groupby(level=[*by, "bin"]).sum()
+        grouper = [merged.index.get_level_values(k) for k in by] or [np.zeros(len(merged), dtype=int)]
+        cum = merged.groupby(grouper).cumsum().to_numpy()
+        total = merged.groupby(grouper).transform("sum").to_numpy()
+        bins = merged.index.get_level_values("bin").to_numpy()
+        estimate = pd.Series(2 * self.GAMMA ** bins / (self.GAMMA + 1), index=merged.index)
+        result = pd.DataFrame({"Nombre": merged.groupby(grouper).sum()})
+        for q in qs:
+            reached = cum > q * (total - 1)  # premier bin dont le rang cumulé dépasse q
+            result[f"p{round(q * 100)}"] = estimate[reached].groupby([g[reached] for g in grouper]).first()
+        return result
+
+
+ROLLUP_PERIODS = {
+    "30 derniers jours": timedelta(days=30),
+    "90 derniers jours": timedelta(days=90),
+    "12 derniers mois": timedelta(days=365),
+    "Tout l'historique": None,
+}
+
+
+def rollup_period_inputs(key_prefix: str):
+    """Sélecteurs granularité / période ; renvoie (freq, start) avec start en UTC."""
+    c1, c2 = st.columns(2)
+    with c1:
+        freq = st.selectbox("Granularité", list(Rollup.FREQS), index=1, key=f"{key_prefix}_freq")
+    with c2:
+        period = st.selectbox("Période", list(ROLLUP_PERIODS), index=2, key=f"{key_prefix}_period")
+    span = ROLLUP_PERIODS[period]
+    start = None if span is None else pd.Timestamp.now(tz="UTC").floor("D") - span
+    return freq, start
+
+
+# ==========================
+# QUASI-DOUBLONS (MinHash / LSH)
+# ==========================
+
+class NearDuplicateIndex:
+    """Index MinHash / LSH des messages côté utilisateur, pour regrouper les scripts répétés.
+
+    Chaque chat est résumé par une signature MinHash de ses 3-grammes de mots ;
+    les signatures sont découpées en bandes et rangées dans des buckets, si bien
+    que seuls les chats partageant un bucket sont comparés (pas de comparaison
+    deux à deux). Les chats nouveaux / modifiés sont insérés au fil de l'ingestion.
+
+    L'index est modifié par le thread d'ingestion (veille) pendant que les sessions
+    le lisent : mutations et lectures passent par `self.lock`, les signatures étant
+    calculées hors verrou.
+    """
+
+    NUM_PERM = 64
+    BANDS = 16  # 16 bandes × 4 lignes : seuil de similarité effectif ~0,5
+    SHINGLE = 3
+    MIN_SHINGLES = 5
+    THRESHOLD = 0.5
+    PRIME = (1 << 31) - 1
+
+    def __init__(self):
+        rng = np.random.default_rng(20240601)
+        self.a = rng.integers(1, self.PRIME, self.NUM_PERM, dtype=np.uint64)
+        self.b = rng.integers(0, self.PRIME, self.NUM_PERM, dtype=np.uint64)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.signatures = {}
+            self.buckets = [{} for _ in range(self.BANDS)]
+            self._clusters = None
+
+    def signature(self, messages: str):
+        """Signature MinHash du texte utilisateur, None s'il est trop court pour être comparé."""
+        words = " ".join(extract_user_messages(messages)).lower().split()
+        shingles = {" ".join(words[i:i + self.SHINGLE]) for i in range(len(words) - self.SHINGLE + 1)}
+        if len(shingles) < self.MIN_SHINGLES:
+            return None
+        x = np.fromiter((zlib.crc32(sh.encode()) for sh in shingles), dtype=np.uint64, count=len(shingles))
+        x %= np.uint64(self.PRIME)
+        hashed = (self.a[:, None] * x[None, :] + self.b[:, None]) % np.uint64(self.PRIME)
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, sig):
+        return [band.tobytes() for band in np.split(sig, self.BANDS)]
+
+    def _remove(self, key):
+        sig = self.signatures.pop(key, None)
+        if sig is None:
+            return
+        for bucket, band_key in zip(self.buckets, self._band_keys(sig)):
+            members = bucket.get(band_key)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del bucket[band_key]
+
+    def apply(self, added: pd.DataFrame, removed: pd.DataFrame):
+        signatures = [
+            (key, self.signature(decompress_transcript(blob)))
+            for key, blob in zip(added["ksaar_id"], added["messages_z"])
+        ]
+        with self.lock:
+            for key in removed["ksaar_id"]:
+                self._remove(key)
+            for key, sig in signatures:
+                self._remove(key)
+                if sig is None:
+                    continue
+                self.signatures[key] = sig
+                for bucket, band_key in zip(self.buckets, self._band_keys(sig)):
+                    bucket.setdefault(band_key, set()).add(key)
+            self._clusters = None
+
+    def clusters(self) -> pd.Series:
+        """Numéro de cluster par clé de chat (chats sans quasi-doublon exclus)."""
+        with self.lock:
+            if self._clusters is None:
+                self._clusters = self._compute_clusters()
+            return self._clusters
+
+    def _compute_clusters(self) -> pd.Series:
+        parent = {}
+
+        def find(k):
+            while parent.setdefault(k, k) != k:
+                parent[k] = parent[parent[k]]
+                k = parent[k]
+            return k
+
+        for bucket in self.buckets:
+            for members in bucket.values():
+                if len(members) < 2:
+                    continue
+                members = sorted(members)
+                head = self.signatures[members[0]]
+                for other in members[1:]:
+                    # on vérifie la similarité estimée pour écarter les faux positifs LSH
+                    if np.mean(self.signatures[other] == head) >= self.THRESHOLD:
+                        parent[find(other)] = find(members[0])
+
+        roots = pd.Series({k: find(k) for k in parent}, dtype=object)
+        sizes = roots.map(roots.value_counts())
+        roots = roots[sizes >= 2]
+        return pd.Series(pd.factorize(roots)[0], index=roots.index, name="cluster")
+
+
+def near_duplicate_clusters(df: pd.DataFrame, min_size: int = 2) -> pd.DataFrame:
+    """Résumé des clusters : taille, antennes touchées, période couverte."""
+    labels = chats_near_duplicates().clusters()
+    if labels.empty:
         return pd.DataFrame()
+    members = df[["ksaar_id", "id_chat", "Crée le", "Antenne", "potentially_abusive"]].merge(
+        labels, left_on="ksaar_id", right_index=True
+    )
+    summary = members.groupby("cluster").agg(
+        Taille=("id_chat", "size"),
+        Antennes=("Antenne", lambda s: ", ".join(sorted(s.dropna().unique()))),
+        Nb_antennes=("Antenne", "nunique"),
+        Premier=("Crée le", "min"),
+        Dernier=("Crée le", "max"),
+        Abusifs=("potentially_abusive", "sum"),
+        Chats=("id_chat", lambda s: ", ".join(str(i) for i in s.head(10))),
+    )
+    summary["Étendue (jours)"] = (summary["Dernier"] - summary["Premier"]).dt.days
+    summary = summary[summary["Taille"] >= min_size]
+    return summary.sort_values(["Taille", "Dernier"], ascending=False)
 
-    df = pd.DataFrame(all_records)
-    df["Crée le"] = pd.to_datetime(df["Crée le"], errors="coerce")
 
-    # ⚠️ TEMPORAIREMENT : on enlève le filtre sur 2025
-    # df = df[df["Crée le"] >= "2025-01-01"]
+# ==========================
+# ACTIVITÉ PAR IP
+# ==========================
 
-    return df
+class IpActivityIndex:
+    """Index IP → chats (horodatage, antenne, flag abusif), maintenu à l'ingestion.
+
+    Les statistiques par IP (contacts, taux d'abus, rafales sur fenêtres glissantes)
+    ne sont recalculées que pour les IP touchées par un delta ; la consultation
+    « tous les chats de cette IP » est une simple lecture de dictionnaire. Comme
+    pour NearDuplicateIndex, mises à jour et lectures passent par `self.lock`.
+    """
+
+    WINDOWS = {"1 h": pd.Timedelta(hours=1), "24 h": pd.Timedelta(hours=24), "7 j": pd.Timedelta(days=7)}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.by_ip = {}
+            self.ip_of = {}
+            self.stats = {}
+            self._ranking = None
+
+    def _remove(self, key):
+        ip = self.ip_of.pop(key, None)
+        if ip is not None:
+            self.by_ip[ip].pop(key, None)
+            if not self.by_ip[ip]:
+                del self.by_ip[ip]
+        return ip
+
+    def apply(self, added: pd.DataFrame, removed: pd.DataFrame):
+        cols = ["ksaar_id", "IP", "Crée le", "id_chat", "Antenne", "potentially_abusive"]
+        with self.lock:
+            touched = {self._remove(key) for key in removed["ksaar_id"]}
+            for key, ip, created, chat_id, antenne, abusive in added[cols].itertuples(index=False, name=None):
+                touched.add(self._remove(key))
+                if not ip or pd.isna(ip):
+                    continue
+                self.by_ip.setdefault(ip, {})[key] = (created, chat_id, antenne, bool(abusive))
+                self.ip_of[key] = ip
+                touched.add(ip)
+            for ip in touched - {None}:
+                self._update_stats(ip)
+            self._ranking = None
+
+    def _update_stats(self, ip):
+        chats = self.by_ip.get(ip)
+        if not chats:
+            self.stats.pop(ip, None)
+            return
+        created, _, antennes, abusive = zip(*chats.values())
+        ts = np.sort(pd.DatetimeIndex(created).dropna().as_unit("ns").asi8)
+        row = {
+            "Contacts": len(chats),
+            "Abusifs": sum(abusive),
+            "Antennes": len(set(antennes)),
+            "Premier": pd.Timestamp(ts[0], tz="UTC") if len(ts) else pd.NaT,
+            "Dernier": pd.Timestamp(ts[-1], tz="UTC") if len(ts) else pd.NaT,
+        }
+        for label, window in self.WINDOWS.items():
+            # rafale : nombre max de chats dans une fenêtre glissante commençant à chaque chat
+            ends = np.searchsorted(ts, ts + window.value, side="right")
+            row[f"Rafale {label}"] = int((ends - np.arange(len(ts))).max()) if len(ts) else 0
+        self.stats[ip] = row
+
+    def ranking(self) -> pd.DataFrame:
+        with self.lock:
+            if self._ranking is None:
+                ranking = pd.DataFrame.from_dict(self.stats, orient="index")
+                if not ranking.empty:
+                    ranking.index.name = "IP"
+                    ranking.insert(2, "Taux d'abus", ranking["Abusifs"] / ranking["Contacts"])
+                self._ranking = ranking
+            return self._ranking
+
+    def lookup(self, ip) -> pd.DataFrame:
+        """Tous les chats connus pour cette IP, du plus récent au plus ancien."""
+        with self.lock:
+            chats = list(self.by_ip.get(ip, {}).values())
+        rows = pd.DataFrame(
+            chats, columns=["Crée le", "id_chat", "Antenne", "potentially_abusive"]
+        )
+        return rows.sort_values("Crée le", ascending=False, ignore_index=True)
+
+
+@st.fragment
+def display_ip_ranking():
+    ranking = chats_ip_index().ranking()
+    if ranking.empty:
+        st.info("Aucune IP renseignée.")
+        return
+    c1, c2 = st.columns(2)
+    with c1:
+        sort_by = st.selectbox(
+            "Trier par",
+            ["Contacts", "Taux d'abus", "Antennes"] + [f"Rafale {w}" for w in IpActivityIndex.WINDOWS],
+            key="ip_sort",
+        )
+    with c2:
+        min_contacts = st.number_input("Contacts minimum", min_value=1, value=2, key="ip_min_contacts")
+    top = ranking[ranking["Contacts"] >= min_contacts].nlargest(50, [sort_by, "Contacts"])
+    st.dataframe(
+        top,
+        use_container_width=True,
+        column_config={
+            "Taux d'abus": st.column_config.ProgressColumn("Taux d'abus", min_value=0, max_value=1, format="percent"),
+            "Premier": st.column_config.DatetimeColumn("Premier chat", format="DD/MM/YYYY HH:mm"),
+            "Dernier": st.column_config.DatetimeColumn("Dernier chat", format="DD/MM/YYYY HH:mm"),
+        },
+    )
+
+
+# ==========================
+# CHARGE SIMULTANÉE (SWEEP-LINE)
+# ==========================
+
+def epoch_minutes(values) -> np.ndarray:
+    return pd.DatetimeIndex(values).as_unit("ns").asi8 // 60_000_000_000
+
+
+class ConcurrencyProfile:
+    """Nombre de chats menés en même temps par groupe (opérateur, antenne), à la minute.
+
+    Balayage vectorisé : chaque chat [pnd_time, last_user_message] produit un
+    événement +1 à sa minute de début et -1 à la minute qui suit sa fin. Après un
+    tri par (groupe, minute), la somme cumulée donne la charge à chaque changement :
+    O(n log n), sans comparer les intervalles deux à deux. Le profil est stocké
+    sous forme de paliers (groupe, minute, charge).
+    """
+
+    def __init__(self, frame: pd.DataFrame, by=None, start_col="pnd_time", end_col="last_user_message"):
+        self.by = by
+        start, end = frame[start_col], frame[end_col]
+        valid = (start.notna() & end.notna() & (end >= start)).to_numpy()
+        labels = frame[by].fillna("Inconnu").to_numpy()[valid] if by else np.full(valid.sum(), "Total")
+        codes, uniques = pd.factorize(labels)
+        self.groups = pd.Index(uniques)
+        self.tz = getattr(start.dt, "tz", None)
+
+        begins = epoch_minutes(start[valid])
+        g = np.concatenate([codes, codes])
+        t = np.concatenate([begins, epoch_minutes(end[valid]) + 1])
+        d = np.concatenate([np.ones(len(begins), np.int32), -np.ones(len(begins), np.int32)])
+        order = np.lexsort((d, t, g))  # à minute égale, les fins passent avant les débuts
+        g, t, level = g[order], t[order], np.cumsum(d[order])
+        last = np.r_[(g[1:] != g[:-1]) | (t[1:] != t[:-1]), True]  # un palier par (groupe, minute)
+        self.g, self.t, self.level = g[last], t[last], level[last]
+        self.bounds = np.searchsorted(self.g, np.arange(len(self.groups) + 1))
+
+    def _timestamps(self, minutes):
+        return pd.to_datetime(np.asarray(minutes) * 60, unit="s", utc=self.tz is not None)
+
+    def peaks(self) -> pd.DataFrame:
+        """Pic de charge par groupe, première minute du pic, et charge moyenne quand actif."""
+        if not len(self.g):
+            return pd.DataFrame()
+        last_of_group = np.r_[self.g[1:] != self.g[:-1], True]
+        duration = np.where(last_of_group, 0, np.diff(self.t, append=self.t[-1]))
+        steps = pd.DataFrame({"g": self.g, "t": self.t, "level": self.level, "duration": duration})
+        top = steps.loc[steps.groupby("g")["level"].idxmax()]
+        active = steps[steps["level"] > 0].assign(load=lambda x: x["level"] * x["duration"])
+        minutes = active.groupby("g")[["duration", "load"]].sum().reindex(top["g"], fill_value=0)
+        return pd.DataFrame(
+            {
+                "Groupe": self.groups[top["g"].to_numpy()],
+                "Pic simultané": top["level"].to_numpy(),
+                "Pic le": self._timestamps(top["t"].to_numpy()),
+                "Heures actives": minutes["duration"].to_numpy() / 60,
+                "Charge moyenne": minutes["load"].to_numpy() / minutes["duration"].clip(lower=1).to_numpy(),
+            }
+        ).sort_values("Pic simultané", ascending=False, ignore_index=True)
+
+    def per_minute(self, groups=None, start=None, end=None) -> pd.DataFrame:
+        """Charge minute par minute (une colonne par groupe) sur [start, end[."""
+        if not len(self.g):
+            return pd.DataFrame()
+        t0 = self.t.min() if start is None else epoch_minutes([start])[0]
+        t1 = self.t.max() if end is None else epoch_minutes([end])[0]
+        grid = np.arange(t0, t1)
+        codes = range(len(self.groups)) if groups is None else self.groups.get_indexer(groups)
+        columns = {}
+        for code in codes:
+            lo, hi = self.bounds[code], self.bounds[code + 1]
+            pos = np.searchsorted(self.t[lo:hi], grid, side="right") - 1
+            columns[self.groups[code]] = np.where(pos >= 0, self.level[lo:hi][np.maximum(pos, 0)], 0)
+        return pd.DataFrame(columns, index=self._timestamps(grid))
+
+
+@st.fragment
+def display_chat_durations():
+    sketches = chats_durations()
+    if sketches.table.empty:
+        st.info("Aucun chat avec horodatages exploitables.")
+        return
+
+    c1, c2 = st.columns(2)
+    with c1:
+        period = st.selectbox("Période", list(ROLLUP_PERIODS), key="durations_period")
+    with c2:
+        antennes = st.multiselect("Antennes", sorted(sketches.table.index.unique("Antenne")), key="durations_ant")
+    span = ROLLUP_PERIODS[period]
+    start = None if span is None else pd.Timestamp.now(tz="UTC").floor("D") - span
+    filters = {"Antenne": antennes} if antennes else {}
+
+    for metric, title in [("Attente (s)", "Attente avant prise en charge"), ("Durée (s)", "Durée du chat")]:
+        per_antenne = sketches.quantiles(metric, start=start, by=("Antenne",), **filters)
+        if per_antenne.empty:
+            continue
+        per_antenne = per_antenne.sort_values("Nombre", ascending=False)
+        st.markdown(f"**{title} (minutes)**")
+        in_minutes = {c: per_antenne[c] / 60 for c in per_antenne.columns if c != "Nombre"}
+        st.dataframe(per_antenne.assign(**in_minutes).round(1), use_container_width=True)
+        per_night = sketches.quantiles(metric, start=start, by=("night",), qs=(0.5, 0.9), **filters)
+        st.line_chart((per_night[["p50", "p90"]] / 60).rename_axis("Nuit"))
+
+
+CONCURRENCY_GROUPS = {"Opérateur": "Operateur_Name", "Antenne": "Antenne", "Toutes antennes": None}
+
+
+@st.fragment
+def display_concurrency():
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        label = st.selectbox("Regrouper par", list(CONCURRENCY_GROUPS), key="concurrency_by")
+    with c2:
+        period = st.selectbox("Période", list(ROLLUP_PERIODS), key="concurrency_period")
+    with c3:
+        resolution = st.selectbox("Résolution du graphique", ["15min", "h", "D"], index=1, key="concurrency_freq")
+    by = CONCURRENCY_GROUPS[label]
+    span = ROLLUP_PERIODS[period]
+
+    query = DatasetQuery(current_chats_dataset())
+    if span is not None:
+        query.date_between("pnd_time", (pd.Timestamp.now(tz="UTC") - span).date(), date.today())
+    chats = query.rows(columns=["pnd_time", "last_user_message"] + ([by] if by else []))
+    if chats.empty:
+        st.info("Aucun chat avec début et fin renseignés sur cette période.")
+        return
+
+    profile = ConcurrencyProfile(chats, by)
+    peaks = profile.peaks()
+    if peaks.empty:
+        st.info("Aucun chat avec début et fin renseignés sur cette période.")
+        return
+    st.dataframe(
+        peaks.rename(columns={"Groupe": label}),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "Pic le": st.column_config.DatetimeColumn("Pic le", format="DD/MM/YYYY HH:mm"),
+            "Heures actives": st.column_config.NumberColumn("Heures actives", format="%.1f"),
+            "Charge moyenne": st.column_config.NumberColumn("Charge moyenne (si actif)", format="%.2f"),
+        },
+    )
+    top = peaks["Groupe"].head(8).tolist()
+    st.markdown(f"**Charge maximale par tranche ({', '.join(map(str, top))})**")
+    st.line_chart(profile.per_minute(top).resample(resolution).max())
+
+
+# ==========================
+# FLUX DE DONNÉES DU PROCESS
+# ==========================
+
+CHATS_TTL = 300
+CALLS_TTL = 600
+
+
+@st.cache_resource
+def chats_feed() -> DatasetFeed:
+    """Flux des chats et structures dérivées, maintenues à chaque ingestion."""
+    feed = DatasetFeed("chats", "ksaar_id", fetch_ksaar_chats, CHATS_TTL)
+    feed.subscribe(Rollup("Crée le", ["Antenne", "Volunteer_Location", "potentially_abusive"]), "rollup")
+    feed.subscribe(NearDuplicateIndex(), "near_duplicates")
+    feed.subscribe(IpActivityIndex(), "ip_activity")
+    feed.subscribe(QuantileSketches("Crée le", "Antenne"), "durations")
+    feed.subscribe(SentimentIndex(), "sentiment")
+    feed.subscribe(TfidfIndex(), "tfidf")
+    feed.subscribe(ChatAlertIndex(ALERTS_CONFIG["min_score"], ALERTS_CONFIG["lookback_minutes"]), "alerts")
+    return feed
+
+
+@st.cache_resource
+def calls_feed() -> DatasetFeed:
+    """Flux des appels et structures dérivées, maintenues à chaque ingestion."""
+    feed = DatasetFeed("appels", "ksaar_id", fetch_ksaar_calls, CALLS_TTL)
+    feed.subscribe(Rollup("Crée le", ["Antenne", "Statut", "Code_de_cloture"]), "rollup")
+    return feed
+
+
+def chats_rollup() -> "Rollup":
+    return chats_feed().indexes["rollup"]
+
+
+def calls_rollup() -> "Rollup":
+    return calls_feed().indexes["rollup"]
+
+
+def chats_durations() -> QuantileSketches:
+    return chats_feed().indexes["durations"]
+
+
+def chats_near_duplicates() -> "NearDuplicateIndex":
+    return chats_feed().indexes["near_duplicates"]
+
+
+def chats_ip_index() -> "IpActivityIndex":
+    return chats_feed().indexes["ip_activity"]
+
+
+def chats_sentiment() -> "SentimentIndex":
+    return chats_feed().indexes["sentiment"]
+
+
+def chats_tfidf() -> "TfidfIndex":
+    return chats_feed().indexes["tfidf"]
+
+
+def chats_alerts() -> "ChatAlertIndex":
+    return chats_feed().indexes["alerts"]
+
+
+def current_chats_dataset() -> SharedDataset:
+    feed = chats_feed()
+    if feed.dataset.empty:
+        with st.spinner("Chargement des chats..."):
+            return feed.current()
+    return feed.current()
+
+
+def current_calls_dataset() -> SharedDataset:
+    feed = calls_feed()
+    if feed.dataset.empty:
+        with st.spinner("Chargement des appels..."):
+            return feed.current()
+    return feed.current()
+
+
+def get_ksaar_chats() -> pd.DataFrame:
+    """Vue (lecture seule) sur les chats partagés par toutes les sessions."""
+    return current_chats_dataset().view()
+
+
+def get_ksaar_calls() -> pd.DataFrame:
+    """Vue (lecture seule) sur les appels partagés par toutes les sessions."""
+    return current_calls_dataset().view()
+
+
+# ==========================
+# MOTEUR SQL ANALYTIQUE (DuckDB)
+# ==========================
+
+@st.cache_resource
+def get_duckdb():
+    """Base DuckDB en mémoire du process ; chaque requête utilise son propre curseur."""
+    con = duckdb.connect(database=":memory:")
+    con.execute("SET GLOBAL TimeZone = 'UTC'")
+    return con
+
+
+class DatasetQuery:
+    """Petite API de requêtes sur un SharedDataset, exécutée par DuckDB.
+
+    Les filtres et agrégations tournent en scans colonnaires directement sur la table
+    Arrow partagée (pas de copie pandas intermédiaire) ; seul le résultat est
+    matérialisé en DataFrame.
+
+        q = DatasetQuery(current_calls_dataset()).isin("Statut", ["ANSWERED"])
+        q.group_count("Antenne", hour_of="Crée le")
+    """
+
+    def __init__(self, dataset: SharedDataset):
+        self.dataset = dataset
+        self.conditions = []
+        self.params = []
+
+    def copy(self) -> "DatasetQuery":
+        q = DatasetQuery(self.dataset)
+        q.conditions, q.params = list(self.conditions), list(self.params)
+        return q
+
+    def _where(self, condition: str, *params):
+        self.conditions.append(condition)
+        self.params.extend(params)
+        return self
+
+    def date_between(self, col: str, start, end):
+        return self._where(f"CAST({sql_ident(col)} AS DATE) BETWEEN ? AND ?", start, end)
+
+    def time_between(self, col: str, start_time, end_time):
+        """Plage horaire ; gère les plages qui passent minuit (21h–06h)."""
+        c = sql_ident(col)
+        seconds = f"(hour({c}) * 3600 + minute({c}) * 60 + second({c}))"
+        start = start_time.hour * 3600 + start_time.minute * 60 + start_time.second
+        end = end_time.hour * 3600 + end_time.minute * 60 + end_time.second
+        op = "AND" if start <= end else "OR"
+        return self._where(f"({seconds} >= ? {op} {seconds} <= ?)", start, end)
+
+    def isin(self, col: str, values, fill=None):
+        """Filtre `col IN values` ; sans valeurs, aucun filtre (comme les multiselect vides)."""
+        if not values:
+            return self
+        expr = sql_ident(col) if fill is None else f"COALESCE({sql_ident(col)}, ?)"
+        params = [list(values)] + ([fill] if fill is not None else [])
+        return self._where(f"list_contains(?, {expr})", *params)
+
+    def contains(self, col: str, text: str):
+        return self._where(f"contains({sql_ident(col)}, ?)", text)
+
+    def transcript_contains(self, text: str, col: str = "messages_z", key: str = "ksaar_id"):
+        """Recherche plein texte (insensible à la casse) dans les transcripts compressés.
+
+        Seuls les transcripts des lignes déjà retenues par les autres filtres sont
+        décompressés ; le filtre devient ensuite un `key IN (...)` pour DuckDB.
+        """
+        needle = text.lower()
+        candidates = self.rows(columns=[key, col])
+        keys = [
+            k for k, blob in zip(candidates.get(key, []), candidates.get(col, []))
+            if needle in decompress_transcript(blob).lower()
+        ]
+        return self._where(f"list_contains(?, {sql_ident(key)})", keys)
+
+    def equals(self, col: str, value):
+        return self._where(f"{sql_ident(col)} = ?", value)
+
+    def is_true(self, col: str):
+        return self._where(sql_ident(col))
+
+    def _execute(self, select: str, tail: str = "", params=()):
+        if self.dataset.empty:
+            return None
+        cur = get_duckdb().cursor()
+        try:
+            cur.register("t", self.dataset.arrow())
+            where = f" WHERE {' AND '.join(self.conditions)}" if self.conditions else ""
+            return cur.execute(f"SELECT {select} FROM t{where} {tail}", [*params, *self.params]).df()
+        finally:
+            cur.close()
+
+    def rows(self, columns=None, order_by=None, limit=None, offset=0) -> pd.DataFrame:
+        select = ", ".join(sql_ident(c) for c in columns) if columns else "*"
+        tail = f"ORDER BY {order_by}" if order_by else ""
+        if limit is not None:
+            tail += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+        res = self._execute(select, tail)
+        return pd.DataFrame() if res is None else res
+
+    def batches(self, columns=None, order_by=None, batch_size=5000):
+        """Résultat en RecordBatch Arrow successifs, sans matérialiser l'ensemble."""
+        if self.dataset.empty:
+            return
+        select = ", ".join(sql_ident(c) for c in columns) if columns else "*"
+        tail = f" ORDER BY {order_by}" if order_by else ""
+        where = f" WHERE {' AND '.join(self.conditions)}" if self.conditions else ""
+        cur = get_duckdb().cursor()
+        try:
+            cur.register("t", self.dataset.arrow())
+            cur.execute(f"SELECT {select} FROM t{where}{tail}", self.params)
+            yield from cur.to_arrow_reader(batch_size)
+        finally:
+            cur.close()
+
+    def count(self) -> int:
+        res = self._execute("count(*) AS n")
+        return 0 if res is None else int(res["n"].iloc[0])
+
+    def distinct(self, col: str, fill=None) -> list:
+        expr = sql_ident(col) if fill is None else f"COALESCE({sql_ident(col)}, ?)"
+        params = [fill] if fill is not None else []
+        res = self._execute(f"DISTINCT {expr} AS v", "ORDER BY v", params)
+        return [] if res is None else res["v"].dropna().tolist()
+
+    def percentiles(self, value_col: str, by: str, qs=(0.5, 0.9, 0.99)) -> pd.DataFrame:
+        """Percentiles (et moyenne / effectif) de `value_col` par `by`, valeurs nulles ignorées."""
+        v = sql_ident(value_col)
+        cols = ", ".join(f"quantile_cont({v}, {q}) AS \"p{round(q * 100)}\"" for q in qs)
+        res = self._execute(
+            f"{sql_ident(by)}, count({v}) AS Nombre, avg({v}) AS Moyenne, {cols}",
+            f"GROUP BY 1 HAVING count({v}) > 0 ORDER BY Nombre DESC",
+        )
+        return pd.DataFrame() if res is None else res.set_index(by)
+
+    def histogram(self, value_col: str, bin_width: float, by: str) -> pd.DataFrame:
+        """Distribution de `value_col` par tranches de `bin_width`, une colonne par `by`."""
+        v = sql_ident(value_col)
+        res = self.copy()._where(f"{v} IS NOT NULL")._execute(
+            f"floor({v} / ?) * ? AS Tranche, {sql_ident(by)}, count(*) AS Nombre",
+            "GROUP BY 1, 2 ORDER BY 1",
+            [bin_width, bin_width],
+        )
+        if res is None or res.empty:
+            return pd.DataFrame()
+        return res.pivot_table(index="Tranche", columns=by, values="Nombre", aggfunc="sum", fill_value=0)
+
+    def group_count(self, *columns, hour_of=None) -> pd.DataFrame:
+        """Comptage par `columns` (et par heure de `hour_of`), trié par effectif décroissant."""
+        dims = [sql_ident(c) for c in columns]
+        if hour_of:
+            dims.append(f"hour({sql_ident(hour_of)}) AS Heure")
+        keys = ", ".join(str(i + 1) for i in range(len(dims)))
+        res = self._execute(f"{', '.join(dims)}, count(*) AS Nombre", f"GROUP BY {keys} ORDER BY Nombre DESC")
+        return pd.DataFrame() if res is None else res
+
+
+# ==========================
+# EXPORT EN MASSE
+# ==========================
+
+EXPORT_SPOOL_BYTES = 32 * 1024 * 1024  # au-delà, le fichier d'export est écrit sur disque
+
+CHATS_EXPORT_COLUMNS = [
+    "ksaar_id", "id_chat", "Crée le", "pnd_time", "last_user_message", "IP", "Antenne",
+    "Volunteer_Location", "Operateur_Name", "preliminary_score", "potentially_abusive", "messages_z",
+]
+CALLS_EXPORT_COLUMNS = [
+    "Crée le", "Nom", "Numéro", "Antenne", "Statut", "Code_de_cloture",
+    "Décroché le", "Terminé le", "Durée (s)", "Attente (s)", "dst",
+]
+
+
+def chat_export_text(chat: dict) -> str:
+    """Transcript d'un chat avec son en-tête, pour l'export ZIP."""
+    created = chat.get("Crée le")
+    return (
+        f"Chat ID : {chat.get('id_chat')}\n"
+        f"Date : {created.strftime('%d/%m/%Y %H:%M') if created else 'N/A'}\n"
+        f"Antenne : {chat.get('Antenne')}\n"
+        f"Bénévole : {chat.get('Volunteer_Location')}\n"
+        f"IP : {chat.get('IP') or 'N/A'}\n"
+        f"Score mots-clés : {chat.get('preliminary_score')}\n"
+        "\n"
+        "===== MESSAGES =====\n\n"
+        f"{chat.get('messages') or ''}"
+    )
+
+
+def with_transcripts(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Remplace la colonne compressée `messages_z` par le texte `messages`."""
+    if "messages_z" not in batch.schema.names:
+        return batch
+    i = batch.schema.get_field_index("messages_z")
+    text = pa.array([decompress_transcript(b) for b in batch.column(i).to_pylist()], pa.string())
+    return batch.set_column(i, "messages", text)
+
+
+def write_export(query: DatasetQuery, fmt: str, columns, order_by=None) -> bytes:
+    """Écrit le résultat de `query` au format `fmt` (csv, parquet, zip), lot par lot.
+
+    Les lignes sont lues par lots Arrow et écrites au fil de l'eau dans un fichier
+    temporaire (en mémoire jusqu'à EXPORT_SPOOL_BYTES, sur disque au-delà) : seul
+    le fichier final est relu pour le téléchargement.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as out:
+        batches = (with_transcripts(b) for b in query.batches(columns, order_by=order_by))
+        if fmt == "csv":
+            header = True
+            for batch in batches:
+                out.write(batch.to_pandas().to_csv(index=False, header=header).encode("utf-8"))
+                header = False
+        elif fmt == "parquet":
+            writer = None
+            for batch in batches:
+                if writer is None:
+                    writer = pq.ParquetWriter(out, batch.schema, compression="zstd")
+                writer.write_batch(batch)
+            if writer is not None:
+                writer.close()
+        elif fmt == "zip":
+            with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                for batch in batches:
+                    for chat in batch.to_pylist():
+                        # ksaar_id est unique (id_chat peut manquer ou se répéter)
+                        name = f"chat_{chat['id_chat']}_{chat['ksaar_id']}" if chat["id_chat"] is not None else f"chat_{chat['ksaar_id']}"
+                        zf.writestr(f"{name}.txt", chat_export_text(chat))
+        else:
+            raise ValueError(f"Format d'export inconnu : {fmt}")
+        out.seek(0)
+        return out.read()
+
+
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "ZIP (un .txt par chat)": ("zip", "application/zip"),
+}
+
+
+def display_export_controls(query: DatasetQuery, nb_rows: int, key_prefix: str, columns, order_by=None, transcripts=False):
+    """Export de la sélection filtrée ; le fichier n'est généré qu'au clic."""
+    formats = [f for f in EXPORT_FORMATS if transcripts or EXPORT_FORMATS[f][0] != "zip"]
+    label = st.radio("Format", formats, horizontal=True, key=f"{key_prefix}_export_format")
+    fmt, mime = EXPORT_FORMATS[label]
+    snapshot = query.copy()  # figé au rendu : le clic exporte ce qui est affiché
+    st.download_button(
+        label=f"📦 Exporter {nb_rows} lignes",
+        data=lambda: write_export(snapshot, fmt, columns, order_by),
+        file_name=f"{key_prefix}_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}",
+        mime=mime,
+        disabled=nb_rows == 0,
+        key=f"{key_prefix}_export",
+    )
 
 
 # ==========================
@@ -554,6 +2193,7 @@ def extract_operator_messages(messages: str):
 def detect_topic_changes(user_messages, threshold=0.2, min_messages=5):
     if len(user_messages) < min_messages:
         return []
+    TfidfVectorizer, cosine_similarity = load_sklearn_text()
     vectorizer = TfidfVectorizer(max_df=0.9, min_df=1, stop_words="french")
     try:
         X = vectorizer.fit_transform(user_messages)
@@ -675,6 +2315,14 @@ def analyze_chat_content(messages: str):
         risk_score += min(len(topic_changes) * 5, 20)
         risk_factors.append(f"Changements de sujet fréquents ({len(topic_changes)})")
 
+    sentiment = chats_sentiment().lookup(msgs)
+    if sentiment["Part tours négatifs"] >= 0.5 or sentiment["Sentiment min"] <= -0.6:
+        risk_score += 15
+        risk_factors.append(f"Détresse émotionnelle (sentiment moyen {sentiment['Sentiment moyen']:.2f})")
+    if sentiment["Tendance sentiment"] <= -0.1:
+        risk_score += 5
+        risk_factors.append("Sentiment qui se dégrade au fil du chat")
+
     risk_score = min(int(risk_score), 100)
     return risk_score, risk_factors, problematic_phrases, operator_harassment, manipulation_patterns, topic_changes
 
@@ -691,6 +2339,554 @@ def get_abuse_risk_level(score: int) -> str:
     return "Très faible"
 
 
+# ==========================
+# SENTIMENT DES MESSAGES UTILISATEUR (TextBlob)
+# ==========================
+
+SENTIMENT_COLUMNS = [
+    "Sentiment moyen", "Sentiment min", "Sentiment final", "Tendance sentiment", "Part tours négatifs",
+]
+
+SENTIMENT_BATCH = 200  # transcripts scorés entre deux publications des colonnes
+
+_sentiment_blobber = None
+
+
+def transcript_hash(messages: str) -> str:
+    return hashlib.blake2b(str(messages).encode(), digest_size=16).hexdigest()
+
+
+def score_sentiment(messages: str) -> dict:
+    """Trajectoire de polarité des tours utilisateur (analyseur français de TextBlob).
+
+    - Sentiment final : moyenne des 3 derniers tours
+    - Tendance sentiment : pente de la polarité au fil des tours (< 0 = dégradation)
+    - Part tours négatifs : proportion de tours de polarité <= -0,3 (détresse)
+    """
+    global _sentiment_blobber
+    if _sentiment_blobber is None:
+        _sentiment_blobber = load_sentiment_blobber()
+
+    polarity = np.array(
+        [_sentiment_blobber(m).sentiment[0] for m in extract_user_messages(str(messages))], dtype=float
+    )
+    if len(polarity) == 0:
+        return dict.fromkeys(SENTIMENT_COLUMNS, 0.0)
+    slope = np.polyfit(np.arange(len(polarity)), polarity, 1)[0] if len(polarity) >= 2 else 0.0
+    return {
+        "Sentiment moyen": float(polarity.mean()),
+        "Sentiment min": float(polarity.min()),
+        "Sentiment final": float(polarity[-3:].mean()),
+        "Tendance sentiment": float(slope),
+        "Part tours négatifs": float((polarity <= -0.3).mean()),
+    }
+
+
+def score_sentiments(texts: list) -> list:
+    """Score un lot de transcripts dans le process courant.
+
+    Pas de pool de processus : forker le serveur Streamlit (multi-threadé) n'est pas
+    sûr, et les fonctions du module `__main__` réinstallé à chaque rerun ne se
+    picklent plus. La mémoïsation par empreinte limite le travail aux nouveaux textes.
+    """
+    return [score_sentiment(t) for t in texts]
+
+
+class SentimentIndex:
+    """Scores de sentiment par chat, calculés en arrière-plan au fil de l'ingestion.
+
+    `apply` ne fait que mettre en file les transcripts reçus (O(delta), sous le
+    verrou du flux) ; un thread dédié les score par lots de SENTIMENT_BATCH et
+    publie les colonnes au fur et à mesure. Après un redémarrage, le premier
+    chargement n'attend donc pas TextBlob : les colonnes se remplissent ensuite.
+    Les scores sont mémoïsés par empreinte du transcript : un chat inchangé (ou un
+    transcript identique) n'est jamais rescoré. Mises à jour et lectures passent
+    par `self.lock`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.memo = {}
+        self.wakeup = threading.Event()
+        self.reset()
+        threading.Thread(target=self._run, name="sentiment", daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.hash_of = {}
+            # file de (premier numéro, lignes) : vues sur les colonnes du delta, sans copie des transcripts
+            self.pending = collections.deque()
+            self.seq = {}  # ksaar_id → numéro de la dernière version reçue
+            self.counter = 0
+            self._scores = None
+
+    def apply(self, added: pd.DataFrame, removed: pd.DataFrame):
+        with self.lock:
+            for key in removed["ksaar_id"]:
+                self.hash_of.pop(key, None)
+                self.seq.pop(key, None)
+            if not added.empty:
+                self.seq.update(zip(added["ksaar_id"], range(self.counter, self.counter + len(added))))
+                self.pending.append((self.counter, added[["ksaar_id", "messages_z"]]))
+                self.counter += len(added)
+            self._scores = None
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while self._score_batch():
+                pass
+
+    def _score_batch(self) -> bool:
+        """Score un lot de la file ; False quand la file est vide."""
+        with self.lock:
+            if not self.pending:
+                return False
+            first, rows = self.pending.popleft()
+            if len(rows) > SENTIMENT_BATCH:
+                self.pending.appendleft((first + SENTIMENT_BATCH, rows.iloc[SENTIMENT_BATCH:]))
+                rows = rows.iloc[:SENTIMENT_BATCH]
+            # lignes retirées ou remplacées depuis leur mise en file : ignorées
+            batch = [
+                (key, seq, blob)
+                for seq, (key, blob) in enumerate(zip(rows["ksaar_id"], rows["messages_z"]), start=first)
+                if self.seq.get(key) == seq
+            ]
+        try:
+            texts = [decompress_transcript(blob) for _, _, blob in batch]
+            hashes = [transcript_hash(m) for m in texts]
+            with self.lock:
+                todo = {h: m for h, m in zip(hashes, texts) if h not in self.memo}
+            scored = dict(zip(todo, score_sentiments(list(todo.values()))))
+        except Exception as e:
+            print(f"Sentiment : lot ignoré ({e!r})", file=sys.stderr)
+            return True
+        with self.lock:
+            self.memo.update(scored)
+            for (key, seq, _), h in zip(batch, hashes):
+                if self.seq.get(key) == seq:  # ni retiré ni remplacé pendant le scoring
+                    self.hash_of[key] = h
+            if len(self.memo) > 2 * len(self.seq):
+                live = set(self.hash_of.values())
+                self.memo = {h: v for h, v in self.memo.items() if h in live}
+            self._scores = None
+        return True
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return sum(len(rows) for _, rows in self.pending)
+
+    def lookup(self, messages: str) -> dict:
+        h = transcript_hash(messages)
+        with self.lock:
+            if h in self.memo:
+                return self.memo[h]
+        scores = score_sentiment(messages)
+        with self.lock:
+            self.memo[h] = scores
+        return scores
+
+    def scores(self) -> pd.DataFrame:
+        """Colonnes de sentiment indexées par ksaar_id (chats déjà scorés)."""
+        with self.lock:
+            if self._scores is None:
+                keys = list(self.hash_of)
+                self._scores = pd.DataFrame(
+                    [self.memo[self.hash_of[k]] for k in keys], index=pd.Index(keys, name="ksaar_id"),
+                    columns=SENTIMENT_COLUMNS,
+                )
+            return self._scores
+
+
+# ==========================
+# CHATS SIMILAIRES (TF-IDF)
+# ==========================
+
+class TfidfIndex:
+    """Matrice TF-IDF creuse (lignes normalisées L2) de tous les transcripts.
+
+    La similarité cosinus d'un chat avec tous les autres se réduit à un produit
+    matrice creuse × vecteur (bloc par bloc), suivi d'un tri partiel pour le top-k.
+
+    Abonné du flux des chats : le vocabulaire et les IDF sont appris une seule fois,
+    au premier usage après un crawl complet (`reset` les invalide). Ensuite, chaque
+    ingestion ne transforme que les lignes nouvelles / modifiées, ajoutées en bloc,
+    et masque leurs anciennes versions : une veille ne provoque jamais de réapprentissage.
+    """
+
+    META = ["ksaar_id", "id_chat", "Crée le", "Antenne", "Volunteer_Location", "potentially_abusive"]
+    MAX_BLOCKS = 32  # au-delà, les blocs sont fusionnés (coût amorti sur autant d'ingestions)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fit_lock = threading.Lock()
+        self.generation = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.generation += 1
+            self.vectorizer = None
+            self.blocks = []  # (matrice CSR, métadonnées des lignes)
+            self.alive = []  # masque des lignes encore à jour, par bloc
+            self.row_of = {}  # ksaar_id → (bloc, ligne)
+            self.backlog = None  # deltas reçus pendant un apprentissage, rejoués ensuite
+
+    @property
+    def fitted(self) -> bool:
+        return self.vectorizer is not None
+
+    def apply(self, added: pd.DataFrame, removed: pd.DataFrame):
+        with self.lock:
+            if self.backlog is not None:
+                self.backlog.append((added, removed))
+            elif self.vectorizer is not None:
+                self._patch(added, removed)
+            # pas encore appris : l'apprentissage lira le jeu complet
+
+    def _patch(self, added: pd.DataFrame, removed: pd.DataFrame):
+        for key in itertools.chain(removed["ksaar_id"], added["ksaar_id"]):
+            loc = self.row_of.pop(key, None)
+            if loc is not None:
+                self.alive[loc[0]][loc[1]] = False
+        if added.empty:
+            return
+        texts = (decompress_transcript(b) for b in added["messages_z"])
+        self._append(self.vectorizer.transform(texts).tocsr(), added)
+        if len(self.blocks) > self.MAX_BLOCKS:
+            self._compact()
+
+    def _append(self, matrix, rows: pd.DataFrame):
+        block = len(self.blocks)
+        self.blocks.append((matrix, rows[self.META].reset_index(drop=True)))
+        self.alive.append(np.ones(len(rows), dtype=bool))
+        self.row_of.update(zip(rows["ksaar_id"], zip(itertools.repeat(block), range(len(rows)))))
+
+    def _compact(self):
+        from scipy import sparse  # dépendance de scikit-learn
+        alive = np.concatenate(self.alive)
+        matrix = sparse.vstack([m for m, _ in self.blocks]).tocsr()[alive]
+        meta = pd.concat([rows for _, rows in self.blocks], ignore_index=True)[alive]
+        self.blocks, self.alive, self.row_of = [], [], {}
+        self._append(matrix, meta)
+
+    def fit(self, feed: DatasetFeed):
+        """Apprend vocabulaire et IDF sur le jeu courant, si ce n'est pas déjà fait.
+
+        L'apprentissage tourne hors des verrous : les deltas ingérés entre-temps
+        sont mis de côté puis rejoués par `_patch`.
+        """
+        with self.fit_lock:
+            with feed.lock, self.lock:
+                if self.vectorizer is not None:
+                    return
+                generation = self.generation
+                self.backlog = []
+                frame = feed.dataset.view()
+            TfidfVectorizer, _ = load_sklearn_text()
+            vectorizer = TfidfVectorizer(sublinear_tf=True, min_df=2, max_df=0.9, dtype=np.float32)
+            try:
+                matrix = vectorizer.fit_transform(decompress_transcript(b) for b in frame["messages_z"]).tocsr()
+            except (KeyError, ValueError):
+                vectorizer = None  # vocabulaire vide (trop peu de chats)
+            with self.lock:
+                if generation != self.generation:
+                    return  # crawl complet pendant l'apprentissage : à refaire au prochain usage
+                backlog, self.backlog = self.backlog, None
+                if vectorizer is None:
+                    return
+                self.vectorizer = vectorizer
+                self._append(matrix, frame)
+                for added, removed in backlog:
+                    self._patch(added, removed)
+
+    def similar(self, key, k: int = 10) -> pd.DataFrame:
+        with self.lock:
+            loc = self.row_of.get(key)
+            if loc is None:
+                return pd.DataFrame()
+            vector = self.blocks[loc[0]][0][loc[1]].toarray().ravel()
+            scores = np.concatenate([m @ vector for m, _ in self.blocks])
+            offsets = np.cumsum([0] + [len(rows) for _, rows in self.blocks])
+            scores[~np.concatenate(self.alive)] = -1.0
+            scores[offsets[loc[0]] + loc[1]] = -1.0
+            blocks = [rows for _, rows in self.blocks]
+        k = min(k, int((scores > -1.0).sum()))
+        if k <= 0:
+            return pd.DataFrame()
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        owner = np.searchsorted(offsets, top, side="right") - 1
+        result = pd.concat(
+            [blocks[b].iloc[[i - offsets[b]]] for b, i in zip(owner, top)], ignore_index=True
+        ).drop(columns="ksaar_id")
+        return result.assign(Similarité=scores[top])
+
+
+def similar_chats(key, k: int = 10) -> pd.DataFrame:
+    """Top-k des chats les plus proches du chat `key` (ksaar_id)."""
+    index = chats_tfidf()
+    if not index.fitted:
+        with st.spinner("Indexation TF-IDF des chats..."):
+            index.fit(chats_feed())
+    return index.similar(key, k)
+
+
+# ==========================
+# ALERTES TEMPS RÉEL (CHATS À RISQUE)
+# ==========================
+
+ALERTS_CONFIG = {
+    "enabled": True,
+    "poll_seconds": 60,  # intervalle de la veille Ksaar (borne la latence création → alerte)
+    "min_score": 60,  # score de risque minimal (analyze_chat_content) : "Élevé" et plus
+    "lookback_minutes": 120,  # seuls les chats créés dans cette fenêtre peuvent déclencher une alerte
+    **ksaar_config.get("alerts", {}),
+}
+ALERT_POLL_OVERLAP = timedelta(minutes=30)  # recouvrement d'une veille : chats encore en cours
+
+
+class ChatAlertIndex:
+    """Abonné du flux des chats qui transforme les arrivées à risque en alertes.
+
+    Seul le delta de chaque ingestion est examiné, et seulement ses chats récents
+    (le rejeu complet d'une resynchronisation ne coûte qu'un filtre sur la date).
+    Le matcher de mots-clés (calculé à l'ingestion) sert de pré-filtre ; l'analyse
+    complète ne tourne que sur ces chats, une fois par version (`Modifié le`).
+    """
+
+    MAX_ALERTS = 200
+
+    def __init__(self, min_score: int, lookback_minutes: int):
+        self.min_score = min_score
+        self.lookback = timedelta(minutes=lookback_minutes)
+        self.scored = {}
+        self.alerts = {}
+        self.lock = threading.Lock()
+
+    def reset(self):
+        pass  # les alertes et les chats déjà scorés survivent à une resynchronisation
+
+    def apply(self, added: pd.DataFrame, removed: pd.DataFrame):
+        created = added["Crée le"]
+        cutoff = pd.Timestamp.now(tz="UTC") - self.lookback
+        if created.dt.tz is None:
+            cutoff = cutoff.tz_localize(None)
+        candidates = added[(created >= cutoff).to_numpy() & added["potentially_abusive"].to_numpy()]
+
+        for chat in candidates.to_dict("records"):
+            key = chat["ksaar_id"]
+            if self.scored.get(key) == chat["Modifié le"]:
+                continue
+            self.scored[key] = chat["Modifié le"]
+            score, factors, *_ = analyze_chat_content(decompress_transcript(chat["messages_z"]))
+            if score < self.min_score:
+                continue
+            detected = pd.Timestamp.now(tz=cutoff.tz)
+            with self.lock:
+                self.alerts[key] = {
+                    "ksaar_id": key,
+                    "id_chat": chat["id_chat"],
+                    "Crée le": chat["Crée le"],
+                    "Antenne": chat["Antenne"],
+                    "Score de risque": score,
+                    "Niveau de risque": get_abuse_risk_level(score),
+                    "Facteurs de risque": ", ".join(factors),
+                    "Détecté le": detected,
+                    "Latence (s)": (detected - chat["Crée le"]).total_seconds(),
+                }
+
+        with self.lock:
+            if len(self.alerts) > self.MAX_ALERTS:
+                newest = sorted(self.alerts.values(), key=lambda a: a["Détecté le"])[-self.MAX_ALERTS:]
+                self.alerts = {a["ksaar_id"]: a for a in newest}
+        if len(self.scored) > 10 * self.MAX_ALERTS:
+            self.scored = {k: v for k, v in self.scored.items() if v >= cutoff - self.lookback}
+
+    def recent(self) -> pd.DataFrame:
+        """Alertes, de la plus récente à la plus ancienne."""
+        with self.lock:
+            alerts = list(self.alerts.values())
+        if not alerts:
+            return pd.DataFrame()
+        return pd.DataFrame(alerts).sort_values("Détecté le", ascending=False, ignore_index=True)
+
+
+def watch_new_chats(feed: DatasetFeed, interval: float):
+    """Boucle de veille : ne recrawle que les pages récentes, sauf quand le TTL du flux est échu."""
+    wide_at = time.time()
+    while True:
+        time.sleep(interval)
+        try:
+            if time.time() - wide_at > feed.ttl:
+                feed.refresh()  # recouvrement habituel (chats modifiés), resynchro complète si due
+                wide_at = time.time()
+            else:
+                feed.refresh(overlap=ALERT_POLL_OVERLAP)
+        except Exception as e:
+            print(f"Veille des chats : {e}", file=sys.stderr)
+
+
+@st.cache_resource
+def start_chat_watcher():
+    """Démarre, une fois par process, le thread de veille des nouveaux chats."""
+    if not ALERTS_CONFIG["enabled"]:
+        return None
+    thread = threading.Thread(
+        target=watch_new_chats,
+        args=(chats_feed(), ALERTS_CONFIG["poll_seconds"]),
+        name="veille-chats",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+@st.fragment(run_every=ALERTS_CONFIG["poll_seconds"])
+def display_chat_alerts():
+    """Fil d'alertes (barre latérale), relu à chaque veille sans relancer toute l'app."""
+    alerts = chats_alerts().recent()
+    st.subheader(f"🚨 Alertes ({len(alerts)})")
+    if alerts.empty:
+        st.caption("Aucun chat à risque élevé récent.")
+        return
+
+    seen = st.session_state.setdefault("alerts_seen", set())
+    for alert in alerts.to_dict("records"):
+        if alert["ksaar_id"] not in seen:
+            st.toast(f"Chat {alert['id_chat']} ({alert['Antenne']}) : risque {alert['Niveau de risque'].lower()}", icon="🚨")
+            seen.add(alert["ksaar_id"])
+
+    st.dataframe(
+        alerts,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "ksaar_id": None,
+            "id_chat": st.column_config.NumberColumn("ID Chat"),
+            "Crée le": st.column_config.DatetimeColumn("Date", format="DD/MM HH:mm"),
+            "Détecté le": st.column_config.DatetimeColumn("Détecté", format="HH:mm:ss"),
+            "Latence (s)": st.column_config.NumberColumn("Latence (s)", format="%d"),
+        },
+    )
+
+
+# ==========================
+# CORRÉLATION APPELS × CHATS
+# ==========================
+
+def missed_calls(calls: pd.DataFrame) -> pd.DataFrame:
+    return calls[(calls["Statut"] != "ANSWERED").to_numpy() & calls["Crée le"].notna().to_numpy()]
+
+
+def chats_during_missed_calls(chats: pd.DataFrame, calls: pd.DataFrame) -> pd.DataFrame:
+    """Chats pendant lesquels leur antenne a laissé passer au moins un appel.
+
+    Jointure as-of par antenne (merge_asof, direction "forward") : pour chaque chat,
+    le premier appel manqué à partir de son début, retenu s'il tombe avant sa fin.
+    Le nombre d'appels manqués pendant le chat vient de deux recherches dichotomiques
+    dans les appels triés de l'antenne. Coût en O((n + m) log m), sans comparer
+    chaque chat à chaque appel.
+    """
+    chats = chats.dropna(subset=["pnd_time", "last_user_message", "Antenne"])
+    missed = missed_calls(calls)
+    if chats.empty or missed.empty:
+        return pd.DataFrame()
+
+    left = chats.assign(at=chats["pnd_time"].dt.as_unit("ns")).sort_values("at", kind="stable")
+    right = (
+        missed[["Antenne", "Crée le"]]
+        .rename(columns={"Crée le": "Premier appel manqué"})
+        .assign(at=lambda x: x["Premier appel manqué"].dt.as_unit("ns"))
+        .sort_values("at", kind="stable")
+    )
+    joined = pd.merge_asof(left, right, on="at", by="Antenne", direction="forward")
+    joined = joined[(joined["Premier appel manqué"] <= joined["last_user_message"]).to_numpy()]
+    if joined.empty:
+        return pd.DataFrame()
+
+    counts = np.zeros(len(joined), dtype=np.int64)
+    def nanoseconds(values):
+        return pd.DatetimeIndex(values).as_unit("ns").asi8
+
+    call_times = {ant: nanoseconds(grp["at"]) for ant, grp in right.groupby("Antenne")}
+    for ant, rows in joined.groupby("Antenne").indices.items():
+        times = call_times[ant]
+        start = nanoseconds(joined["pnd_time"].iloc[rows])
+        end = nanoseconds(joined["last_user_message"].iloc[rows])
+        counts[rows] = np.searchsorted(times, end, side="right") - np.searchsorted(times, start, side="left")
+    return joined.drop(columns="at").assign(**{"Appels manqués": counts}).sort_values(
+        "pnd_time", ascending=False, ignore_index=True
+    )
+
+
+def combined_load(chats: pd.DataFrame, calls: pd.DataFrame) -> pd.DataFrame:
+    """Contacts par antenne et heure de la journée (UTC) : chats commencés, appels, appels manqués."""
+    def per_hour(frame, time_col):
+        return frame.groupby([frame["Antenne"], frame[time_col].dt.hour.rename("Heure")]).size()
+
+    load = pd.DataFrame({
+        "Chats": per_hour(chats.dropna(subset=["pnd_time"]), "pnd_time"),
+        "Appels": per_hour(calls.dropna(subset=["Crée le"]), "Crée le"),
+        "Appels manqués": per_hour(missed_calls(calls), "Crée le"),
+    }).fillna(0).astype(int)
+    return load.assign(Total=load["Chats"] + load["Appels"])
+
+
+@st.fragment
+@timed_section("Appels × chats")
+def display_correlation():
+    st.subheader("Appels et chats par antenne")
+    period = st.selectbox("Période", list(ROLLUP_PERIODS), key="correlation_period")
+    span = ROLLUP_PERIODS[period]
+
+    chats_query = DatasetQuery(current_chats_dataset())
+    calls_query = DatasetQuery(current_calls_dataset())
+    if span is not None:
+        since = (pd.Timestamp.now(tz="UTC") - span).date()
+        chats_query.date_between("pnd_time", since, date.today())
+        calls_query.date_between("Crée le", since, date.today())
+    chats = chats_query.rows(columns=["id_chat", "Antenne", "pnd_time", "last_user_message", "potentially_abusive"])
+    calls = calls_query.rows(columns=["Antenne", "Crée le", "Statut"])
+    if chats.empty or calls.empty:
+        st.info("Pas assez de données d'appels et de chats sur cette période.")
+        return
+
+    load = combined_load(chats, calls)
+    st.markdown("**Charge combinée par heure (chats + appels)**")
+    st.bar_chart(load["Total"].unstack("Antenne", fill_value=0))
+    st.dataframe(
+        load.groupby(level="Antenne").sum().sort_values("Total", ascending=False),
+        use_container_width=True,
+    )
+    with st.expander("Détail antenne × heure"):
+        st.dataframe(load, use_container_width=True)
+
+    overlapping = chats_during_missed_calls(chats, calls)
+    c1, c2 = st.columns(2)
+    with c1:
+        st.metric("Chats avec appel manqué pendant le chat", len(overlapping))
+    with c2:
+        st.metric("Part des chats", f"{len(overlapping) / len(chats):.0%}")
+    if overlapping.empty:
+        st.info("Aucun appel manqué pendant un chat de la même antenne.")
+        return
+    st.dataframe(
+        overlapping,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "id_chat": st.column_config.NumberColumn("ID Chat"),
+            "pnd_time": st.column_config.DatetimeColumn("Début du chat", format="DD/MM/YYYY HH:mm"),
+            "last_user_message": st.column_config.DatetimeColumn("Fin du chat", format="DD/MM/YYYY HH:mm"),
+            "potentially_abusive": st.column_config.CheckboxColumn("Potentiellement abusif"),
+            "Premier appel manqué": st.column_config.DatetimeColumn("Premier appel manqué", format="HH:mm"),
+        },
+    )
+
+
 # ==========================
 # AFFICHAGE : APPELS
 # ==========================
@@ -701,70 +2897,134 @@ def display_calls():
         st.warning("Aucune donnée d'appel.")
         return
 
+    calls_explorer(df)
+
+    if st.sidebar.button("🔄 Rafraîchir les appels"):
+        calls_feed().reset()
+        st.rerun()
+
+
+@st.fragment
+@timed_section("Appels – filtres et synthèse")
+def calls_explorer(df: pd.DataFrame):
+    """Filtres (formulaire), synthèse et tableau : seule cette section se relance à la validation."""
     st.subheader("Filtres appels")
 
     default_start = max(df["Crée le"].min().date(), date.today() - timedelta(days=7))
     default_end = df["Crée le"].max().date()
 
-    c1, c2 = st.columns(2)
-    with c1:
-        start_date = st.date_input("Date de début", value=default_start)
-    with c2:
-        end_date = st.date_input("Date de fin", value=default_end, min_value=start_date)
-
-    c3, c4 = st.columns(2)
-    with c3:
-        start_time = st.time_input("Heure de début", value=datetime.strptime("00:00", "%H:%M").time())
-    with c4:
-        end_time = st.time_input("Heure de fin", value=datetime.strptime("23:59", "%H:%M").time())
-
-    c5, c6 = st.columns(2)
-    with c5:
-        statuts = sorted(df["Statut"].dropna().unique().tolist())
-        statut_sel = st.multiselect("Statut", statuts, default=statuts)
-    with c6:
-        codes = df["Code_de_cloture"].fillna("(vide)").unique().tolist()
-        codes = sorted(codes)
-        code_sel = st.multiselect("Code de clôture", codes, default=codes)
-
-    mask = (df["Crée le"].dt.date >= start_date) & (df["Crée le"].dt.date <= end_date)
-
-    # filtre heure
-    def to_time(dt):
-        try:
-            return dt.time()
-        except Exception:
-            return None
+    with st.form("calls_filters"):
+        c1, c2 = st.columns(2)
+        with c1:
+            start_date = st.date_input("Date de début", value=default_start)
+        with c2:
+            end_date = st.date_input("Date de fin", value=default_end, min_value=start_date)
 
-    tmp = df.copy()
-    tmp["time"] = tmp["Crée le"].apply(to_time)
-    if start_time <= end_time:
-        mask &= (tmp["time"] >= start_time) & (tmp["time"] <= end_time)
-    else:
-        # plage type 21h–06h
-        mask &= (tmp["time"] >= start_time) | (tmp["time"] <= end_time)
-
-    if statut_sel:
-        mask &= tmp["Statut"].isin(statut_sel)
-    if code_sel:
-        mask &= tmp["Code_de_cloture"].fillna("(vide)").isin(code_sel)
+        c3, c4 = st.columns(2)
+        with c3:
+            start_time = st.time_input("Heure de début", value=datetime.strptime("00:00", "%H:%M").time())
+        with c4:
+            end_time = st.time_input("Heure de fin", value=datetime.strptime("23:59", "%H:%M").time())
 
-    fdf = tmp[mask].copy()
+        c5, c6 = st.columns(2)
+        with c5:
+            statuts = DatasetQuery(current_calls_dataset()).distinct("Statut")
+            statut_sel = st.multiselect("Statut", statuts, default=statuts)
+        with c6:
+            codes = DatasetQuery(current_calls_dataset()).distinct("Code_de_cloture", fill="(vide)")
+            code_sel = st.multiselect("Code de clôture", codes, default=codes)
+        st.form_submit_button("Appliquer les filtres")
+
+    # filtres exécutés par DuckDB sur la table partagée (plage type 21h–06h gérée)
+    query = (
+        DatasetQuery(current_calls_dataset())
+        .date_between("Crée le", start_date, end_date)
+        .time_between("Crée le", start_time, end_time)
+        .isin("Statut", statut_sel)
+        .isin("Code_de_cloture", code_sel, fill="(vide)")
+    )
+    total = query.count()
 
     c1, c2, c3 = st.columns(3)
     with c1:
-        st.metric("Nb appels", len(fdf))
+        st.metric("Nb appels", total)
     with c2:
         st.metric("Période", f"{start_date.strftime('%d/%m/%Y')} → {end_date.strftime('%d/%m/%Y')}")
     with c3:
         st.metric("Plage horaire", f"{start_time.strftime('%H:%M')} → {end_time.strftime('%H:%M')}")
 
+    with st.expander("Répartition antenne × heure × statut"):
+        breakdown = query.group_count("Antenne", "Statut", hour_of="Crée le")
+        if breakdown.empty:
+            st.info("Aucun appel pour ces filtres.")
+        else:
+            st.bar_chart(breakdown.pivot_table(index="Heure", columns="Statut", values="Nombre", aggfunc="sum"))
+            st.dataframe(
+                breakdown.pivot_table(
+                    index=["Antenne", "Heure"], columns="Statut", values="Nombre", aggfunc="sum", fill_value=0
+                ),
+                use_container_width=True,
+            )
+
+    with st.expander("⏱️ Durées d'appel par antenne"):
+        durations = query.percentiles("Durée (s)", by="Antenne")
+        if durations.empty:
+            st.info("Aucun appel décroché pour ces filtres.")
+        else:
+            waits = query.percentiles("Attente (s)", by="Antenne")
+            st.markdown("**Durée de l'appel (minutes)**")
+            in_minutes = {c: durations[c] / 60 for c in durations.columns if c != "Nombre"}
+            st.dataframe(durations.assign(**in_minutes).round(1), use_container_width=True)
+            st.markdown("**Attente avant décroché (secondes)**")
+            st.dataframe(waits.round(0), use_container_width=True)
+            st.markdown("**Distribution des durées (tranches de 5 minutes)**")
+            st.bar_chart(query.histogram("Durée (s)", 300, by="Antenne").rename(index=lambda s: int(s // 60)))
+
+    with st.expander("📈 KPI et tendances (agrégats)"):
+        calls_trends()
+
+    with st.expander("📦 Exporter les appels filtrés"):
+        display_export_controls(query, total, "appels", CALLS_EXPORT_COLUMNS, order_by='"Crée le" DESC')
+
+    calls_grid(query, total)
+
+
+@st.fragment
+def calls_trends():
+    freq, start = rollup_period_inputs("calls_trends")
+    by_status = calls_rollup().query(freq, start=start, by=["Statut"])
+    if by_status.empty:
+        st.info("Aucun appel sur cette période.")
+    else:
+        per_status = by_status.groupby(level="Statut").sum()
+        nb_calls = int(per_status.sum())
+        answered = int(per_status.get("ANSWERED", 0))
+        k1, k2, k3 = st.columns(3)
+        with k1:
+            st.metric("Appels", nb_calls)
+        with k2:
+            st.metric("Appels répondus", f"{answered / nb_calls:.0%}")
+        with k3:
+            st.metric("Non répondus / occupés", nb_calls - answered)
+        st.line_chart(by_status.unstack("Statut", fill_value=0))
+        st.bar_chart(
+            calls_rollup().query(freq, start=start, by=["Antenne"]).groupby(level="Antenne").sum()
+        )
+
+
+@st.fragment
+@timed_section("Appels – tableau")
+def calls_grid(query: DatasetQuery, total: int):
+    """Page courante, sélection et détail : la pagination ne relance que ce fragment."""
     if "calls_page" not in st.session_state:
         st.session_state["calls_page"] = 0
 
     PAGE_SIZE = 50
     page = st.session_state["calls_page"]
-    paginated = load_data_paginated(fdf, page, PAGE_SIZE)
+    if page * PAGE_SIZE >= total:
+        page = 0
+    paginated = query.rows(limit=PAGE_SIZE, offset=page * PAGE_SIZE)
+    track_session_frame("Appels (page affichée)", paginated)
 
     paginated["Code_de_cloture"] = paginated["Code_de_cloture"].fillna("(vide)")
     paginated["select"] = False
@@ -775,6 +3035,8 @@ def display_calls():
         hide_index=True,
         num_rows="dynamic",
         column_config={
+            "ksaar_id": None,
+            "Modifié le": None,
             "select": st.column_config.CheckboxColumn("Sélectionner", default=False),
             "Crée le": st.column_config.DatetimeColumn("Date", format="DD/MM/YYYY HH:mm"),
             "Nom": st.column_config.TextColumn("Nom (origine)"),
@@ -784,10 +3046,14 @@ def display_calls():
             "Code_de_cloture": st.column_config.TextColumn("Code de clôture"),
             "Début appel": st.column_config.TextColumn("Heure début"),
             "Fin appel": st.column_config.TextColumn("Heure fin"),
+            "Décroché le": None,
+            "Terminé le": None,
+            "Durée (s)": st.column_config.NumberColumn("Durée (s)", format="%d"),
+            "Attente (s)": st.column_config.NumberColumn("Attente (s)", format="%d"),
         },
     )
 
-    display_pagination_controls(len(fdf), PAGE_SIZE, page, key_prefix="calls")
+    display_pagination_controls(total, PAGE_SIZE, page, key_prefix="calls")
 
     if st.button("Analyser les appels sélectionnés"):
         sel = edited[edited["select"]]
@@ -803,17 +3069,22 @@ def display_calls():
                 st.write(f"**Code de clôture :** {row['Code_de_cloture']}")
                 st.write(f"**Heure début :** {row['Début appel']}")
                 st.write(f"**Heure fin :** {row['Fin appel']}")
+                st.write(f"**Durée :** {format_duration(row['Durée (s)'])}")
+                st.write(f"**Attente avant décroché :** {format_duration(row['Attente (s)'])}")
                 st.write("---")
 
-    if st.sidebar.button("🔄 Rafraîchir les appels"):
-        get_ksaar_calls.clear()
-        st.experimental_rerun()
-
 
 # ==========================
 # AFFICHAGE : ANALYSE IA ABUS
 # ==========================
 
+ABUSE_SORTS = {
+    "Score mots-clés": None,
+    "Sentiment le plus négatif": "Sentiment min",
+    "Sentiment qui se dégrade": "Tendance sentiment",
+}
+
+
 def display_abuse_analysis():
     st.title("Analyse IA des chats potentiellement abusifs")
 
@@ -822,107 +3093,241 @@ def display_abuse_analysis():
         st.warning("Aucune donnée de chat.")
         return
 
-    c1, c2 = st.columns(2)
-    with c1:
-        default_start = max(df["Crée le"].min().date(), date.today() - timedelta(days=30))
-        start_date = st.date_input("Date de début", value=default_start)
-    with c2:
-        end_date = st.date_input("Date de fin", value=df["Crée le"].max().date(), min_value=start_date)
+    with st.expander("📈 KPI et tendances (agrégats)"):
+        abuse_trends()
 
-    use_time_filter = st.checkbox("Filtrer par heure", value=False)
-    if use_time_filter:
+    with st.expander("🧬 Chats quasi-identiques (scripts répétés)"):
+        near_duplicates_panel(df)
+
+    with st.expander("🌐 Activité par IP (contacts répétés)"):
+        display_ip_ranking()
+
+    with st.expander("⏱️ Attente et durée des chats (percentiles)"):
+        display_chat_durations()
+
+    with st.expander("👥 Charge simultanée des opérateurs / antennes"):
+        display_concurrency()
+
+    abuse_explorer(df)
+
+    if st.sidebar.button("🔄 Rafraîchir les chats / analyse"):
+        chats_feed().reset()
+        st.rerun()
+
+
+@st.fragment
+def abuse_trends():
+    freq, start = rollup_period_inputs("chats_trends")
+    by_flag = chats_rollup().query(freq, start=start, by=["potentially_abusive"])
+    if by_flag.empty:
+        st.info("Aucun chat sur cette période.")
+    else:
+        trend = by_flag.unstack("potentially_abusive", fill_value=0).reindex(
+            columns=[False, True], fill_value=0
+        )
+        trend.columns = ["Autres chats", "Potentiellement abusifs"]
+        nb_chats = int(trend.to_numpy().sum())
+        nb_flagged = int(trend["Potentiellement abusifs"].sum())
+        k1, k2, k3 = st.columns(3)
+        with k1:
+            st.metric("Chats", nb_chats)
+        with k2:
+            st.metric("Potentiellement abusifs", nb_flagged)
+        with k3:
+            st.metric("Taux", f"{nb_flagged / nb_chats:.0%}")
+        st.line_chart(trend)
+        st.bar_chart(
+            chats_rollup()
+            .query(freq, start=start, by=["Antenne"], potentially_abusive=[True])
+            .groupby(level="Antenne")
+            .sum()
+        )
+
+
+@st.fragment
+def near_duplicates_panel(df: pd.DataFrame):
+    min_size = st.slider("Taille minimale du cluster", 2, 20, 3, key="near_dup_min_size")
+    clusters = near_duplicate_clusters(df, min_size)
+    if clusters.empty:
+        st.info("Aucun groupe de chats quasi-identiques.")
+    else:
+        st.metric("Clusters", len(clusters))
+        st.dataframe(
+            clusters,
+            use_container_width=True,
+            column_config={
+                "Nb_antennes": st.column_config.NumberColumn("Nb antennes"),
+                "Premier": st.column_config.DatetimeColumn("Premier chat", format="DD/MM/YYYY HH:mm"),
+                "Dernier": st.column_config.DatetimeColumn("Dernier chat", format="DD/MM/YYYY HH:mm"),
+                "Chats": st.column_config.TextColumn("ID chats (10 premiers)"),
+            },
+        )
+
+
+@st.fragment
+@timed_section("Chats – filtres et synthèse")
+def abuse_explorer(df: pd.DataFrame):
+    """Filtres (formulaire) et synthèse : seule cette section se relance à la validation."""
+    with st.form("abuse_filters"):
+        c1, c2 = st.columns(2)
+        with c1:
+            default_start = max(df["Crée le"].min().date(), date.today() - timedelta(days=30))
+            start_date = st.date_input("Date de début", value=default_start)
+        with c2:
+            end_date = st.date_input("Date de fin", value=df["Crée le"].max().date(), min_value=start_date)
+
+        # dans un formulaire, les heures restent affichées : la case décide si elles s'appliquent
+        use_time_filter = st.checkbox("Filtrer par heure", value=False)
         c3, c4 = st.columns(2)
         with c3:
             start_time = st.time_input("Heure de début", value=datetime.strptime("00:00", "%H:%M").time())
         with c4:
             end_time = st.time_input("Heure de fin", value=datetime.strptime("23:59", "%H:%M").time())
-    else:
-        start_time = datetime.strptime("00:00", "%H:%M").time()
-        end_time = datetime.strptime("23:59", "%H:%M").time()
-
-    c5, c6 = st.columns(2)
-    with c5:
-        antennes = sorted(df["Antenne"].dropna().unique().tolist())
-        sel_ant = st.multiselect("Antennes", ["Toutes"] + antennes, default=["Toutes"])
-    with c6:
-        benevoles = sorted(df["Volunteer_Location"].dropna().unique().tolist())
-        sel_ben = st.multiselect("Bénévoles", ["Tous"] + benevoles, default=["Tous"])
-
-    c7, c8 = st.columns(2)
-    with c7:
-        search_text = st.text_input("Recherche texte dans les messages")
-    with c8:
-        search_id = st.text_input("Rechercher par ID chat")
-
-    # filtre date / heure
-    filtered = df.copy()
-    filtered = filtered[
-        (filtered["Crée le"].dt.date >= start_date)
-        & (filtered["Crée le"].dt.date <= end_date)
-    ]
 
+        c5, c6 = st.columns(2)
+        with c5:
+            antennes = sorted(df["Antenne"].dropna().unique().tolist())
+            sel_ant = st.multiselect("Antennes", ["Toutes"] + antennes, default=["Toutes"])
+        with c6:
+            benevoles = sorted(df["Volunteer_Location"].dropna().unique().tolist())
+            sel_ben = st.multiselect("Bénévoles", ["Tous"] + benevoles, default=["Tous"])
+
+        c7, c8 = st.columns(2)
+        with c7:
+            search_text = st.text_input("Recherche texte dans les messages")
+        with c8:
+            search_id = st.text_input("Rechercher par ID chat")
+        st.form_submit_button("Appliquer les filtres")
+
+    # filtres exécutés par DuckDB sur la table partagée
+    query = DatasetQuery(current_chats_dataset()).date_between("Crée le", start_date, end_date)
     if use_time_filter:
-        def to_time(dt):
-            try:
-                return dt.time()
-            except Exception:
-                return None
-
-        filtered["time"] = filtered["Crée le"].apply(to_time)
-        if start_time <= end_time:
-            mask_time = (filtered["time"] >= start_time) & (filtered["time"] <= end_time)
-        else:
-            mask_time = (filtered["time"] >= start_time) | (filtered["time"] <= end_time)
-        filtered = filtered[mask_time].drop(columns=["time"])
-
+        query.time_between("Crée le", start_time, end_time)
     if "Toutes" not in sel_ant:
-        filtered = filtered[filtered["Antenne"].isin(sel_ant)]
+        query.isin("Antenne", sel_ant)
     if "Tous" not in sel_ben:
-        filtered = filtered[filtered["Volunteer_Location"].isin(sel_ben)]
+        query.isin("Volunteer_Location", sel_ben)
 
     if search_text:
-        filtered = filtered[filtered["messages_lower"].str.contains(search_text.lower(), na=False)]
+        query.transcript_contains(search_text)
 
     if search_id:
         try:
             cid = int(search_id)
-            tmp = filtered[filtered["id_chat"] == cid]
-            if tmp.empty:
+            found = query.copy().equals("id_chat", cid)
+            if found.count() == 0:
                 st.warning(f"Aucun chat avec l'ID {cid}")
             else:
-                filtered = tmp
+                query = found
                 st.success(f"Chat {cid} trouvé.")
         except ValueError:
             st.error("ID doit être un entier.")
 
-    abusive_df = filtered[filtered["potentially_abusive"]].copy()
+    nb_filtered = query.count()
+    query.is_true("potentially_abusive")
+    nb_abusive = query.count()
 
-    if abusive_df.empty:
+    if nb_abusive == 0:
         st.warning("Aucun chat potentiellement abusif avec ces filtres.")
         return
 
     c1, c2 = st.columns(2)
     with c1:
-        st.metric("Chats filtrés", len(filtered))
+        st.metric("Chats filtrés", nb_filtered)
     with c2:
-        st.metric("Chats potentiellement abusifs", len(abusive_df))
+        st.metric("Chats potentiellement abusifs", nb_abusive)
 
     with st.expander("Répartition par antenne / bénévole"):
         c3, c4 = st.columns(2)
         with c3:
             st.subheader("Par antenne")
-            st.bar_chart(abusive_df["Antenne"].value_counts())
+            st.bar_chart(query.group_count("Antenne").set_index("Antenne")["Nombre"])
         with c4:
             st.subheader("Par bénévole")
-            st.bar_chart(abusive_df["Volunteer_Location"].value_counts())
+            st.bar_chart(query.group_count("Volunteer_Location").set_index("Volunteer_Location")["Nombre"])
 
-    st.subheader("Liste des chats potentiellement abusifs")
+    with st.expander("📦 Exporter les chats potentiellement abusifs"):
+        display_export_controls(
+            query, nb_abusive, "chats", CHATS_EXPORT_COLUMNS, order_by="preliminary_score DESC", transcripts=True
+        )
+
+    abuse_grid(df, query)
+
+
+def analyze_selected_chats(df: pd.DataFrame, selected: pd.DataFrame) -> pd.DataFrame:
+    """Analyse détaillée des chats cochés, triée par score de risque décroissant."""
+    results = []
+    with st.spinner("Analyse détaillée..."):
+        for _, row in selected.iterrows():
+            cid = row["id_chat"]
+            full_chat = df[df["id_chat"] == cid]
+            if full_chat.empty:
+                continue
+            chat_row = full_chat.iloc[0]
+            messages = decompress_transcript(chat_row["messages_z"])
+
+            score, factors, phrases, harass, patterns, changes = analyze_chat_content(messages)
+
+            phr_text = ""
+            for cat, lst in phrases.items():
+                if lst:
+                    phr_text += f"**{cat}**\n"
+                    for p in lst[:3]:
+                        phr_text += f"- {p}\n"
+                    phr_text += "\n"
+
+            results.append(
+                {
+                    "ksaar_id": chat_row["ksaar_id"],
+                    "id_chat": cid,
+                    "Crée le": chat_row["Crée le"],
+                    "Antenne": chat_row["Antenne"],
+                    "Volunteer_Location": chat_row["Volunteer_Location"],
+                    "IP": chat_row.get("IP", ""),
+                    "Score de risque": score,
+                    "Niveau de risque": get_abuse_risk_level(score),
+                    "Facteurs de risque": ", ".join(factors),
+                    "Phrases problématiques": phr_text,
+                    "Harcèlement opérateur": "Oui" if harass else "Non",
+                    "Nb patterns manipulation": len(patterns),
+                    "Nb changements de sujet": len(changes),
+                    "messages": messages,
+                }
+            )
 
-    abusive_df = abusive_df.sort_values("preliminary_score", ascending=False)
-    abusive_df["select"] = False
+    if not results:
+        return pd.DataFrame()
+    return pd.DataFrame(results).sort_values("Score de risque", ascending=False)
+
+
+@st.fragment
+@timed_section("Chats – tableau")
+def abuse_grid(df: pd.DataFrame, query: DatasetQuery):
+    """Tri, sélection et lancement de l'analyse : cocher une ligne ne relance que ce fragment."""
+    st.subheader("Liste des chats potentiellement abusifs")
 
-    max_rows = st.slider("Nombre max de lignes à afficher", 10, 300, 100)
-    abusive_display = abusive_df.head(max_rows)
+    c9, c10 = st.columns(2)
+    with c9:
+        max_rows = st.slider("Nombre max de lignes à afficher", 10, 300, 100)
+    with c10:
+        sort_by = st.selectbox("Trier par", list(ABUSE_SORTS))
+
+    sentiment = chats_sentiment().scores()
+    pending = chats_sentiment().pending_count()
+    if pending:
+        st.caption(f"⏳ Sentiment en cours de calcul ({pending} chats restants) : colonnes partielles.")
+    sort_col = ABUSE_SORTS[sort_by]
+    if sort_col is None:
+        abusive_display = query.rows(order_by="preliminary_score DESC", limit=max_rows)
+    else:
+        keys = query.rows(columns=["ksaar_id"])["ksaar_id"]
+        ranked = sentiment[sort_col].reindex(keys).sort_values(kind="stable").head(max_rows).index
+        abusive_display = query.copy().isin("ksaar_id", list(ranked)).rows()
+        abusive_display = abusive_display.set_index("ksaar_id").loc[ranked].reset_index()
+    abusive_display = abusive_display.join(sentiment, on="ksaar_id")
+    abusive_display["messages"] = [decompress_transcript(b) for b in abusive_display.pop("messages_z")]
+    abusive_display["select"] = False
+    track_session_frame("Chats abusifs affichés", abusive_display)
 
     edited = st.data_editor(
         abusive_display,
@@ -939,11 +3344,15 @@ def display_abuse_analysis():
                 min_value=0,
                 max_value=50,
             ),
+            "Sentiment moyen": st.column_config.NumberColumn("Sentiment moyen", format="%.2f"),
+            "Sentiment min": st.column_config.NumberColumn("Sentiment min", format="%.2f"),
+            "Tendance sentiment": st.column_config.NumberColumn("Tendance", format="%.3f"),
             "messages": st.column_config.TextColumn("Messages", width="large"),
         },
         column_order=[
             "select", "id_chat", "Crée le", "Antenne",
-            "Volunteer_Location", "preliminary_score", "messages",
+            "Volunteer_Location", "preliminary_score", "Sentiment moyen",
+            "Sentiment min", "Tendance sentiment", "messages",
         ],
     )
 
@@ -951,117 +3360,119 @@ def display_abuse_analysis():
         selected = edited[edited["select"]]
         if selected.empty:
             st.warning("Sélectionne au moins un chat.")
-            return
+        else:
+            res_df = analyze_selected_chats(df, selected)
+            if res_df.empty:
+                st.warning("Pas de résultats d'analyse.")
+            # conservé en session : changer de chat dans le détail ne perd plus l'analyse
+            st.session_state["abuse_detail"] = None if res_df.empty else res_df
+            track_session_frame("Analyse détaillée", res_df)
 
-        results = []
-        with st.spinner("Analyse détaillée..."):
-            for _, row in selected.iterrows():
-                cid = row["id_chat"]
-                full_chat = df[df["id_chat"] == cid]
-                if full_chat.empty:
-                    continue
-                chat_row = full_chat.iloc[0]
-                messages = chat_row["messages"]
-
-                score, factors, phrases, harass, patterns, changes = analyze_chat_content(messages)
-
-                phr_text = ""
-                for cat, lst in phrases.items():
-                    if lst:
-                        phr_text += f"**{cat}**\n"
-                        for p in lst[:3]:
-                            phr_text += f"- {p}\n"
-                        phr_text += "\n"
-
-                results.append(
-                    {
-                        "id_chat": cid,
-                        "Crée le": chat_row["Crée le"],
-                        "Antenne": chat_row["Antenne"],
-                        "Volunteer_Location": chat_row["Volunteer_Location"],
-                        "IP": chat_row.get("IP", ""),
-                        "Score de risque": score,
-                        "Niveau de risque": get_abuse_risk_level(score),
-                        "Facteurs de risque": ", ".join(factors),
-                        "Phrases problématiques": phr_text,
-                        "Harcèlement opérateur": "Oui" if harass else "Non",
-                        "Nb patterns manipulation": len(patterns),
-                        "Nb changements de sujet": len(changes),
-                        "messages": messages,
-                    }
-                )
+    abuse_detail()
 
-        if not results:
-            st.warning("Pas de résultats d'analyse.")
-            return
 
-        res_df = pd.DataFrame(results).sort_values("Score de risque", ascending=False)
+@st.fragment
+@timed_section("Chats – détail")
+def abuse_detail():
+    res_df = st.session_state.get("abuse_detail")
+    if res_df is None:
+        return
 
-        st.subheader("Résultats de l'analyse détaillée")
-        st.dataframe(
-            res_df[[
-                "id_chat", "Crée le", "Antenne", "Volunteer_Location",
-                "Score de risque", "Niveau de risque", "Facteurs de risque",
-                "Harcèlement opérateur", "Nb patterns manipulation",
-                "Nb changements de sujet",
-            ]],
-            use_container_width=True,
-        )
+    st.subheader("Résultats de l'analyse détaillée")
+    st.dataframe(
+        res_df[[
+            "id_chat", "Crée le", "Antenne", "Volunteer_Location",
+            "Score de risque", "Niveau de risque", "Facteurs de risque",
+            "Harcèlement opérateur", "Nb patterns manipulation",
+            "Nb changements de sujet",
+        ]],
+        use_container_width=True,
+    )
 
-        selected_id = st.selectbox(
-            "Voir le détail complet d'un chat",
-            res_df["id_chat"].tolist(),
-        )
+    selected_id = st.selectbox(
+        "Voir le détail complet d'un chat",
+        res_df["id_chat"].tolist(),
+    )
 
-        if selected_id:
-            sel = res_df[res_df["id_chat"] == selected_id].iloc[0]
-            st.markdown(f"### Chat {selected_id}")
-
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                st.write(f"**Date :** {sel['Crée le'].strftime('%d/%m/%Y %H:%M')}")
-            with c2:
-                st.write(f"**Antenne :** {sel['Antenne']}")
-            with c3:
-                st.write(f"**Bénévole :** {sel['Volunteer_Location']}")
-
-            st.write(f"**IP :** {sel.get('IP', 'N/A')}")
-            st.write(f"**Score :** {sel['Score de risque']} ({sel['Niveau de risque']})")
-            st.write(f"**Facteurs de risque :** {sel['Facteurs de risque']}")
-            st.write(f"**Harcèlement envers l'opérateur :** {sel['Harcèlement opérateur']}")
-
-            if sel["Phrases problématiques"]:
-                st.subheader("Phrases problématiques détectées")
-                st.markdown(sel["Phrases problématiques"])
-
-            st.subheader("Contenu du chat")
-            st.text_area("Messages", sel["messages"], height=350)
-
-            # ===== Téléchargement du chat sélectionné =====
-            chat_text = (
-                f"Chat ID : {sel['id_chat']}\n"
-                f"Date : {sel['Crée le'].strftime('%d/%m/%Y %H:%M')}\n"
-                f"Antenne : {sel['Antenne']}\n"
-                f"Bénévole : {sel['Volunteer_Location']}\n"
-                f"IP : {sel.get('IP', 'N/A')}\n"
-                f"Score de risque : {sel['Score de risque']} ({sel['Niveau de risque']})\n"
-                f"Facteurs de risque : {sel['Facteurs de risque']}\n"
-                f"Harcèlement opérateur : {sel['Harcèlement opérateur']}\n"
-                "\n"
-                "===== MESSAGES =====\n\n"
-                f"{sel['messages']}"
-            )
+    if selected_id:
+        sel = res_df[res_df["id_chat"] == selected_id].iloc[0]
+        st.markdown(f"### Chat {selected_id}")
 
-            st.download_button(
-                label="📥 Télécharger ce chat (.txt)",
-                data=chat_text,
-                file_name=f"chat_{sel['id_chat']}.txt",
-                mime="text/plain",
-            )
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            st.write(f"**Date :** {sel['Crée le'].strftime('%d/%m/%Y %H:%M')}")
+        with c2:
+            st.write(f"**Antenne :** {sel['Antenne']}")
+        with c3:
+            st.write(f"**Bénévole :** {sel['Volunteer_Location']}")
+
+        st.write(f"**IP :** {sel.get('IP', 'N/A')}")
+        same_ip = chats_ip_index().lookup(sel.get("IP"))
+        if len(same_ip) > 1:
+            with st.expander(f"Tous les chats de cette IP ({len(same_ip)})"):
+                st.dataframe(
+                    same_ip,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "Crée le": st.column_config.DatetimeColumn("Date", format="DD/MM/YYYY HH:mm"),
+                        "id_chat": st.column_config.NumberColumn("ID Chat"),
+                        "potentially_abusive": st.column_config.CheckboxColumn("Potentiellement abusif"),
+                    },
+                )
+        st.write(f"**Score :** {sel['Score de risque']} ({sel['Niveau de risque']})")
+        st.write(f"**Facteurs de risque :** {sel['Facteurs de risque']}")
+        st.write(f"**Harcèlement envers l'opérateur :** {sel['Harcèlement opérateur']}")
+
+        if sel["Phrases problématiques"]:
+            st.subheader("Phrases problématiques détectées")
+            st.markdown(sel["Phrases problématiques"])
+
+        # action explicite : l'index TF-IDF n'est (re)construit qu'à la demande, pas à chaque rendu
+        if st.button("🔎 Chats similaires", key="similar_chats_button"):
+            st.session_state["similar_chats"] = (sel["ksaar_id"], similar_chats(sel["ksaar_id"]))
+        similar_key, similar = st.session_state.get("similar_chats", (None, None))
+        if similar_key == sel["ksaar_id"]:
+            if similar.empty:
+                st.info("Aucun chat similaire trouvé.")
+            else:
+                st.dataframe(
+                    similar,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "id_chat": st.column_config.NumberColumn("ID Chat"),
+                        "Crée le": st.column_config.DatetimeColumn("Date", format="DD/MM/YYYY HH:mm"),
+                        "Volunteer_Location": st.column_config.TextColumn("Bénévole"),
+                        "potentially_abusive": st.column_config.CheckboxColumn("Potentiellement abusif"),
+                        "Similarité": st.column_config.ProgressColumn("Similarité", min_value=0, max_value=1),
+                    },
+                )
 
-    if st.sidebar.button("🔄 Rafraîchir les chats / analyse"):
-        get_ksaar_chats.clear()
-        st.experimental_rerun()
+        st.subheader("Contenu du chat")
+        st.text_area("Messages", sel["messages"], height=350)
+
+        # ===== Téléchargement du chat sélectionné =====
+        chat_text = (
+            f"Chat ID : {sel['id_chat']}\n"
+            f"Date : {sel['Crée le'].strftime('%d/%m/%Y %H:%M')}\n"
+            f"Antenne : {sel['Antenne']}\n"
+            f"Bénévole : {sel['Volunteer_Location']}\n"
+            f"IP : {sel.get('IP', 'N/A')}\n"
+            f"Score de risque : {sel['Score de risque']} ({sel['Niveau de risque']})\n"
+            f"Facteurs de risque : {sel['Facteurs de risque']}\n"
+            f"Harcèlement opérateur : {sel['Harcèlement opérateur']}\n"
+            "\n"
+            "===== MESSAGES =====\n\n"
+            f"{sel['messages']}"
+        )
+
+        st.download_button(
+            label="📥 Télécharger ce chat (.txt)",
+            data=chat_text,
+            file_name=f"chat_{sel['id_chat']}.txt",
+            mime="text/plain",
+        )
 
 
 # ==========================
@@ -1078,17 +3489,27 @@ def main():
         st.write(f"API base URL : {ksaar_config.get('api_base_url', 'N/A')}")
         st.write(f"API key name configurée : {bool(ksaar_config.get('api_key_name'))}")
         st.write(f"API key password configuré : {bool(ksaar_config.get('api_key_password'))}")
+        loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+        st.write(f"Imports du script : {IMPORTS_SECONDS * 1000:.0f} ms")
+        st.write(f"Modules NLP chargés : {', '.join(loaded) if loaded else 'aucun'}")
+        for section, ms in st.session_state.get("render_ms", {}).items():
+            st.write(f"Dernier rendu – {section} : {ms:.0f} ms")
 
     if not check_password():
+        st.caption(f"Page générée en {(time.perf_counter() - SCRIPT_START) * 1000:.0f} ms")
         return
 
     st.sidebar.title("Navigation")
     if st.sidebar.button("🚪 Déconnexion"):
         for k in list(st.session_state.keys()):
             del st.session_state[k]
-        st.experimental_rerun()
+        st.rerun()
+
+    if start_chat_watcher() is not None:
+        with st.sidebar:
+            display_chat_alerts()
 
-    tab1, tab2 = st.tabs(["📞 Appels", "🧠 Analyse IA des abus"])
+    tab1, tab2, tab3 = st.tabs(["📞 Appels", "🧠 Analyse IA des abus", "🔗 Appels × chats"])
 
     with tab1:
         display_calls()
@@ -1096,6 +3517,15 @@ def main():
     with tab2:
         display_abuse_analysis()
 
+    with tab3:
+        display_correlation()
+
+    display_memory_report()
+    st.session_state.setdefault("render_ms", {})["Rerun complet"] = (time.perf_counter() - SCRIPT_START) * 1000
+
 
 if __name__ == "__main__":
-    main()
+    if "--sync-store" in sys.argv:
+        sync_shared_store()
+    else:
+        main()